@@ -0,0 +1,5 @@
+# Web process entry point: runs the bot in webhook mode (see Procfile)
+from bot import main
+
+if __name__ == "__main__":
+    main(mode="webhook")
@@ -0,0 +1,135 @@
+"""Benchmarks for keyword matching and notification fan-out.
+
+Runs the real handlers from ``bot.py`` against the in-memory stand-ins in
+``benchmarks.fakes``, so neither a bot token nor MongoDB is needed::
+
+    python -m benchmarks.bench --users 1000 10000 100000
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+# bot.py insists on a MongoDB URI at import time; nothing connects to it here
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("METRICS_PORT", "0")
+
+import bot  # noqa: E402
+from benchmarks.corpus import generate_messages, generate_users, make_update  # noqa: E402
+from benchmarks.fakes import FakeBot, MemoryDatabase  # noqa: E402
+from cache import UserCache  # noqa: E402
+from dedup import NearDuplicateIndex  # noqa: E402
+from digest import DigestBuffer  # noqa: E402
+from dispatcher import NotificationDispatcher, Outbox  # noqa: E402
+from storage import BatchWriter, ensure_indexes  # noqa: E402
+from subscribers import SubscriberIndex  # noqa: E402
+
+
+def reset_bot_state(database: MemoryDatabase, workers: int) -> None:
+    # Fresh in-memory state bound to `database` for every run
+    bot.bind_database(database)
+    bot.subscriber_index = SubscriberIndex()
+    bot.user_cache = UserCache(database.users)
+    bot.near_duplicates = NearDuplicateIndex()
+    bot.digest_buffer = DigestBuffer(database.digest_items)
+    bot.batch_writer = BatchWriter(database.collected_data)
+    bot.dispatcher = NotificationDispatcher(
+        Outbox(database.outbox), database.notifications, workers=workers
+    )
+
+
+# Messages that must not match anything; a hit means a false-positive fan-out
+FALSE_POSITIVES = (
+    "My parent is current on torrent",
+    "Pay with Visa card",
+    "I need a bank transfer to my account",
+    "Wire transfer only",
+)
+
+
+def check_matching() -> None:
+    for text in FALSE_POSITIVES:
+        matched = bot.keyword_matcher.match(text)
+        assert not matched, f"{text!r} matched {matched}"
+
+
+def bench_matching(message_count: int, rounds: int) -> None:
+    messages = generate_messages(bot.service_keywords, message_count, seed=1)
+    texts = [message["text"] for message in messages]
+    matched = sum(1 for text in texts if bot.keyword_matcher.match(text))
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for text in texts:
+            bot.keyword_matcher.match(text)
+    elapsed = time.perf_counter() - started
+    total = message_count * rounds
+    print(
+        f"matching: {total} messages in {elapsed:.2f}s -> "
+        f"{total / elapsed:,.0f} messages/s ({matched}/{message_count} match)"
+    )
+
+
+async def bench_fanout(
+    user_count: int, message_count: int, latency: float, workers: int
+) -> None:
+    database = MemoryDatabase()
+    reset_bot_state(database, workers)
+    await ensure_indexes(
+        database.collected_data,
+        database.users,
+        database.notifications,
+        database.outbox,
+        database.digest_items,
+    )
+    await database.users.insert_many(generate_users(bot.available_services, user_count))
+    await bot.subscriber_index.load(database.users)
+
+    messages = generate_messages(
+        bot.service_keywords, message_count, match_ratio=1.0, seed=2
+    )
+    updates = [make_update(message) for message in messages]
+    fake_bot = FakeBot(latency=latency)
+
+    await bot.batch_writer.start()
+    await bot.dispatcher.start(fake_bot)
+    started = time.perf_counter()
+    for update in updates:
+        await bot.collect_data(update, None)
+    ingested = time.perf_counter() - started
+    await bot.dispatcher.stop(timeout=None)
+    elapsed = time.perf_counter() - started
+    await bot.batch_writer.stop()
+
+    sent = len(fake_bot.sent)
+    print(
+        f"fan-out: {user_count:>7} users, {message_count} messages -> "
+        f"{sent:>8} notifications in {elapsed:6.2f}s = {sent / elapsed:>9,.0f}/s "
+        f"(ingest {ingested / message_count * 1000:.1f} ms/message, "
+        f"db ops {sum(database.operation_counts().values())})"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--messages", type=int, default=5, help="ads per fan-out run")
+    parser.add_argument("--corpus", type=int, default=20000, help="matching corpus size")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0, help="fake send latency (s)")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    # Per-notification info logs would dominate the measurements
+    logging.disable(logging.INFO)
+
+    check_matching()
+    bench_matching(args.corpus, args.rounds)
+    for user_count in args.users:
+        asyncio.run(bench_fanout(user_count, args.messages, args.latency, args.workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Synthetic group traffic and user base for benchmarks and replays."""
+
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from telegram import Chat, Message, Update, User
+
+from matcher import Keywords, flatten_keywords
+
+_FILLER = (
+    "hi everyone, does anyone know a good place for coffee near the old town",
+    "the weather is great today, going to the beach later",
+    "thanks for the help yesterday!",
+    "what time does the market close on sundays",
+    "is the bus to the airport still running at night",
+    "looking for people to play football this weekend",
+    "any recommendations for a georgian language teacher",
+    "the internet is down again in our building",
+)
+
+_AD_TEMPLATES = (
+    "{keyword} - {rooms} bedroom apartment in {district}, {price} USD per month, "
+    "call {phone}",
+    "Hello! {keyword}. Located in {district}, price {price} USD, write me in DM",
+    "{keyword} available from next week in {district}, contact {phone} for details",
+    "Best offer: {keyword}, {district}, only {price} USD. Photos on request.",
+)
+
+_DISTRICTS = ("Vake", "Saburtalo", "Old Batumi", "New Boulevard", "Gonio", "Chakvi")
+
+
+def generate_messages(
+    service_keywords: Dict[str, Keywords],
+    count: int,
+    match_ratio: float = 0.3,
+    chats: int = 50,
+    seed: int = 0,
+) -> List[dict]:
+    # Mix of ads built around service keywords and ordinary chatter
+    rng = random.Random(seed)
+    keywords = [
+        keyword
+        for service in service_keywords.values()
+        for keyword in flatten_keywords(service)
+    ]
+    messages = []
+    for message_id in range(1, count + 1):
+        if rng.random() < match_ratio:
+            text = rng.choice(_AD_TEMPLATES).format(
+                keyword=rng.choice(keywords).capitalize(),
+                rooms=rng.randint(1, 4),
+                district=rng.choice(_DISTRICTS),
+                price=rng.randrange(200, 3000, 50),
+                phone=f"+995 5{rng.randint(10, 99)} {rng.randint(100000, 999999)}",
+            )
+            # Unique tail so ads aren't collapsed as near-duplicates
+            text += f" (ref {rng.getrandbits(48):x} {rng.getrandbits(48):x})"
+        else:
+            text = rng.choice(_FILLER)
+        chat_index = rng.randrange(chats)
+        messages.append(
+            {
+                "chat_id": -1001000000000 - chat_index,
+                "chat_title": f"Group {chat_index}",
+                "chat_username": f"group{chat_index}",
+                "message_id": message_id,
+                "user_id": 500000 + rng.randrange(10000),
+                "username": f"member{rng.randrange(10000)}",
+                "text": text,
+            }
+        )
+    return messages
+
+
+def make_update(message: dict, bot=None) -> Update:
+    chat = Chat(
+        id=message["chat_id"],
+        type=Chat.SUPERGROUP,
+        title=message["chat_title"],
+        username=message["chat_username"],
+    )
+    user = User(
+        id=message["user_id"],
+        first_name="Member",
+        is_bot=False,
+        username=message["username"],
+    )
+    update = Update(
+        update_id=message["message_id"],
+        message=Message(
+            message_id=message["message_id"],
+            date=datetime.utcnow(),
+            chat=chat,
+            from_user=user,
+            text=message["text"],
+        ),
+    )
+    if bot is not None:
+        update.set_bot(bot)
+    return update
+
+
+def generate_users(
+    services: List[str], count: int, max_services: int = 3, seed: int = 0
+) -> List[dict]:
+    # Skewed popularity: the first services are picked far more often
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(services))]
+    trial_end_date = datetime.utcnow() + timedelta(days=30)
+    users = []
+    for user_id in range(1, count + 1):
+        picked = set(rng.choices(services, weights, k=rng.randint(1, max_services)))
+        users.append(
+            {
+                "user_id": user_id,
+                "username": f"user{user_id}",
+                "status": True,
+                "trial_end_date": trial_end_date,
+                "services": sorted(picked),
+            }
+        )
+    return users
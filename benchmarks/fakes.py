@@ -0,0 +1,544 @@
+"""Local stand-ins for MongoDB (via Motor) and the Telegram bot.
+
+Only the parts of the Motor API and the query language that ``bot.py`` uses
+are implemented. Single-field lookups (equality or ``$in``) on the first field
+of an index are served from a hash map so large user counts don't turn every
+query into a scan.
+"""
+
+import asyncio
+import itertools
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+_MISSING = object()
+
+
+class Result:
+    def __init__(self, **fields) -> None:
+        self.acknowledged = True
+        self.__dict__.update(fields)
+
+
+def _get(document: dict, path: str) -> Any:
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _equals(value: Any, expected: Any) -> bool:
+    if value is _MISSING:
+        return expected is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value == expected
+
+
+def _compare(value: Any, operator: str, operand: Any) -> bool:
+    if value is _MISSING or value is None or isinstance(value, list):
+        return False
+    try:
+        if operator == "$lt":
+            return value < operand
+        if operator == "$lte":
+            return value <= operand
+        if operator == "$gt":
+            return value > operand
+        return value >= operand
+    except TypeError:
+        return False  # Mongo never matches across types
+
+
+_TYPES = {"string": str, "date": datetime, "bool": bool, "array": list, "object": dict}
+
+
+def _matches_condition(value: Any, condition: Any) -> bool:
+    if not isinstance(condition, dict) or not any(
+        key.startswith("$") for key in condition
+    ):
+        return _equals(value, condition)
+    for operator, operand in condition.items():
+        if operator == "$eq":
+            ok = _equals(value, operand)
+        elif operator == "$ne":
+            ok = not _equals(value, operand)
+        elif operator == "$in":
+            ok = _in(value, operand)
+        elif operator == "$nin":
+            ok = not _in(value, operand)
+        elif operator in ("$lt", "$lte", "$gt", "$gte"):
+            ok = _compare(value, operator, operand)
+        elif operator == "$exists":
+            ok = (value is not _MISSING) == bool(operand)
+        elif operator == "$not":
+            ok = not _matches_condition(value, operand)
+        elif operator == "$type":
+            ok = value is not _MISSING and isinstance(value, _TYPES[operand])
+        else:
+            raise NotImplementedError(f"Query operator {operator}")
+        if not ok:
+            return False
+    return True
+
+
+def _in(value: Any, options: Any) -> bool:
+    if isinstance(options, frozenset):
+        if value is _MISSING:
+            return None in options
+        if isinstance(value, list):
+            return any(_hashable(item) in options for item in value)
+        return _hashable(value) in options
+    return any(_equals(value, option) for option in options)
+
+
+def _prepare(query: Any) -> Any:
+    # Turns $in/$nin lists into sets once per query instead of scanning them
+    # for every document
+    if isinstance(query, list):
+        return [_prepare(item) for item in query]
+    if not isinstance(query, dict):
+        return query
+    prepared = {}
+    for key, value in query.items():
+        if key in ("$in", "$nin") and isinstance(value, (list, tuple, set)):
+            prepared[key] = frozenset(_hashable(option) for option in value)
+        else:
+            prepared[key] = _prepare(value)
+    return prepared
+
+
+def matches(document: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(document, branch) for branch in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(document, branch) for branch in condition):
+                return False
+        elif not _matches_condition(_get(document, key), condition):
+            return False
+    return True
+
+
+def _evaluate(expression: Any, document: dict) -> Any:
+    # Aggregation expressions used by the update pipelines in bot.py
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = _get(document, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, list):
+        return [_evaluate(item, document) for item in expression]
+    if not isinstance(expression, dict) or len(expression) != 1:
+        return expression
+    (operator, operand), = expression.items()
+    if not operator.startswith("$"):
+        return {operator: _evaluate(operand, document)}
+    args = _evaluate(operand, document)
+    if operator == "$ifNull":
+        return next((arg for arg in args if arg is not None), None)
+    if operator == "$cond":
+        condition, if_true, if_false = args
+        return if_true if condition else if_false
+    if operator == "$in":
+        return args[0] in args[1]
+    if operator == "$concatArrays":
+        return list(itertools.chain.from_iterable(args))
+    if operator == "$eq":
+        return args[0] == args[1]
+    if operator == "$size":
+        return len(args[0] if isinstance(operand, list) else args)
+    if operator == "$not":
+        return not (args[0] if isinstance(operand, list) else args)
+    raise NotImplementedError(f"Expression operator {operator}")
+
+
+def _apply_update(document: dict, update: Any, inserting: bool) -> None:
+    if isinstance(update, list):
+        for stage in update:
+            (stage_name, fields), = stage.items()
+            if stage_name == "$unset":
+                for field in [fields] if isinstance(fields, str) else fields:
+                    document.pop(field, None)
+                continue
+            if stage_name not in ("$set", "$addFields"):
+                raise NotImplementedError(f"Pipeline stage {stage_name}")
+            for field, expression in fields.items():
+                document[field] = _evaluate(expression, document)
+        return
+
+    for operator, fields in update.items():
+        for field, value in fields.items():
+            if operator == "$set":
+                document[field] = value
+            elif operator == "$setOnInsert":
+                if inserting:
+                    document[field] = value
+            elif operator == "$unset":
+                document.pop(field, None)
+            elif operator == "$inc":
+                document[field] = document.get(field, 0) + value
+            elif operator == "$addToSet":
+                items = document.setdefault(field, [])
+                if value not in items:
+                    items.append(value)
+            elif operator == "$push":
+                document.setdefault(field, []).append(value)
+            elif operator == "$pull":
+                document[field] = [
+                    item for item in document.get(field, []) if item != value
+                ]
+            else:
+                raise NotImplementedError(f"Update operator {operator}")
+
+
+def _project(document: dict, projection: Optional[dict]) -> dict:
+    copy = {
+        key: list(value) if isinstance(value, list) else value
+        for key, value in document.items()
+    }
+    if not projection:
+        return copy
+    included = {field for field, flag in projection.items() if flag and field != "_id"}
+    if included:
+        keep = included | ({"_id"} if projection.get("_id", 1) else set())
+        return {key: value for key, value in copy.items() if key in keep}
+    return {key: value for key, value in copy.items() if projection.get(key, 1)}
+
+
+def _index_values(value: Any) -> Iterable:
+    if value is _MISSING:
+        return (None,)
+    if isinstance(value, list):
+        return value or (None,)
+    return (value,)
+
+
+class _Index:
+    def __init__(self, name: str, fields: Tuple[str, ...], unique: bool) -> None:
+        self.name = name
+        self.fields = fields
+        self.unique = unique
+        self.by_first: Dict[Any, set] = {}
+        self.by_key: Dict[tuple, Any] = {}
+
+    def key(self, document: dict) -> tuple:
+        values = [_get(document, field) for field in self.fields]
+        return tuple(None if value is _MISSING else value for value in values)
+
+    def add(self, document: dict) -> None:
+        for value in _index_values(_get(document, self.fields[0])):
+            self.by_first.setdefault(_hashable(value), set()).add(document["_id"])
+        if self.unique:
+            key = _hashable(self.key(document))
+            owner = self.by_key.get(key, document["_id"])
+            if owner != document["_id"]:
+                raise DuplicateKeyError(f"E11000 duplicate key error index: {self.name}")
+            self.by_key[key] = document["_id"]
+
+    def remove(self, document: dict) -> None:
+        for value in _index_values(_get(document, self.fields[0])):
+            ids = self.by_first.get(_hashable(value))
+            if ids is not None:
+                ids.discard(document["_id"])
+        if self.unique:
+            self.by_key.pop(_hashable(self.key(document)), None)
+
+
+def _hashable(value: Any) -> Any:
+    if isinstance(value, list):
+        return tuple(_hashable(item) for item in value)
+    if isinstance(value, tuple):
+        return tuple(_hashable(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _hashable(item)) for key, item in value.items()))
+    return value
+
+
+class MemoryCursor:
+    def __init__(self, documents: List[dict]) -> None:
+        self._documents = documents
+        self._limit = 0
+
+    def limit(self, count: int) -> "MemoryCursor":
+        self._limit = count
+        return self
+
+    def sort(self, key: str, direction: int = 1) -> "MemoryCursor":
+        self._documents.sort(
+            key=lambda document: _get(document, key), reverse=direction < 0
+        )
+        return self
+
+    def _selected(self) -> List[dict]:
+        return self._documents[: self._limit] if self._limit else self._documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self._selected():
+            yield document
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        documents = self._selected()
+        return documents[:length] if length else list(documents)
+
+
+class MemoryCollection:
+    """Motor-compatible in-memory collection."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._documents: Dict[Any, dict] = {}
+        self._indexes: Dict[str, _Index] = {}
+        self.operations = 0
+
+    # Lookup helpers
+
+    def _candidates(self, query: dict) -> Iterable[dict]:
+        if "_id" in query and not isinstance(query["_id"], dict):
+            document = self._documents.get(query["_id"])
+            return [document] if document is not None else []
+        best = None
+        for index in self._indexes.values():
+            condition = query.get(index.fields[0], _MISSING)
+            if condition is _MISSING:
+                continue
+            if isinstance(condition, dict) and set(condition) == {"$in"}:
+                values = condition["$in"]
+            elif isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+                continue
+            else:
+                values = [condition]
+            ids = set()
+            for value in values:
+                ids |= index.by_first.get(_hashable(value), set())
+            if best is None or len(ids) < len(best):
+                best = ids
+        if best is None:
+            return list(self._documents.values())
+        return [self._documents[_id] for _id in best if _id in self._documents]
+
+    def _select(self, query: Optional[dict]) -> List[dict]:
+        query = _prepare(query or {})
+        return [
+            document for document in self._candidates(query) if matches(document, query)
+        ]
+
+    def _store(self, document: dict) -> None:
+        added = []
+        try:
+            for index in self._indexes.values():
+                index.add(document)
+                added.append(index)
+        except DuplicateKeyError:
+            for index in added:
+                index.remove(document)
+            raise
+        self._documents[document["_id"]] = document
+
+    def _unstore(self, document: dict) -> None:
+        for index in self._indexes.values():
+            index.remove(document)
+        self._documents.pop(document["_id"], None)
+
+    # Motor API
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None):
+        self.operations += 1
+        return MemoryCursor(
+            [_project(document, projection) for document in self._select(query)]
+        )
+
+    async def find_one(self, query: Optional[dict] = None, projection: Optional[dict] = None):
+        self.operations += 1
+        selected = self._select(query)
+        return _project(selected[0], projection) if selected else None
+
+    async def count_documents(self, query: dict) -> int:
+        self.operations += 1
+        return len(self._select(query))
+
+    async def insert_one(self, document: dict) -> Result:
+        self.operations += 1
+        document.setdefault("_id", ObjectId())
+        self._store(_project(document, None))
+        return Result(inserted_id=document["_id"])
+
+    async def insert_many(self, documents: List[dict], ordered: bool = True) -> Result:
+        self.operations += 1
+        inserted, errors = [], []
+        for position, document in enumerate(documents):
+            document.setdefault("_id", ObjectId())
+            try:
+                self._store(_project(document, None))
+                inserted.append(document["_id"])
+            except DuplicateKeyError as e:
+                errors.append({"index": position, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError(
+                {"writeErrors": errors, "nInserted": len(inserted), "writeConcernErrors": []}
+            )
+        return Result(inserted_ids=inserted)
+
+    def _update(self, document: dict, update: Any, inserting: bool = False) -> None:
+        updated = _project(document, None)
+        _apply_update(updated, update, inserting)
+        self._unstore(document)
+        try:
+            self._store(updated)
+        except DuplicateKeyError:
+            self._store(document)
+            raise
+
+    def _upsert(self, query: dict, update: Any) -> dict:
+        document = {
+            key: value
+            for key, value in query.items()
+            if not key.startswith("$") and not isinstance(value, dict)
+        }
+        document.setdefault("_id", ObjectId())
+        _apply_update(document, update, inserting=True)
+        self._store(document)
+        return document
+
+    async def update_one(self, query: dict, update: Any, upsert: bool = False) -> Result:
+        self.operations += 1
+        selected = self._select(query)
+        if selected:
+            self._update(selected[0], update)
+            return Result(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            document = self._upsert(query, update)
+            return Result(matched_count=0, modified_count=0, upserted_id=document["_id"])
+        return Result(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def update_many(self, query: dict, update: Any) -> Result:
+        self.operations += 1
+        selected = self._select(query)
+        for document in selected:
+            self._update(document, update)
+        return Result(matched_count=len(selected), modified_count=len(selected))
+
+    async def find_one_and_update(
+        self,
+        query: dict,
+        update: Any,
+        projection: Optional[dict] = None,
+        upsert: bool = False,
+        return_document: bool = False,
+    ):
+        self.operations += 1
+        selected = self._select(query)
+        if not selected:
+            if not upsert:
+                return None
+            document = self._upsert(query, update)
+            return _project(document, projection) if return_document else None
+        before = selected[0]
+        self._update(before, update)
+        after = self._documents[before["_id"]]
+        return _project(after if return_document else before, projection)
+
+    async def delete_one(self, query: dict) -> Result:
+        self.operations += 1
+        selected = self._select(query)
+        if selected:
+            self._unstore(selected[0])
+        return Result(deleted_count=len(selected[:1]))
+
+    async def delete_many(self, query: dict) -> Result:
+        self.operations += 1
+        selected = self._select(query)
+        for document in selected:
+            self._unstore(document)
+        return Result(deleted_count=len(selected))
+
+    async def bulk_write(self, requests: list, ordered: bool = True) -> Result:
+        self.operations += 1
+        for request in requests:
+            if isinstance(request, InsertOne):
+                document = request._doc
+                document.setdefault("_id", ObjectId())
+                self._store(_project(document, None))
+            elif isinstance(request, UpdateOne):
+                selected = self._select(request._filter)
+                if selected:
+                    self._update(selected[0], request._doc)
+                elif request._upsert:
+                    self._upsert(request._filter, request._doc)
+            else:
+                raise NotImplementedError(type(request).__name__)
+        return Result()
+
+    async def create_index(self, keys, unique: bool = False, **_) -> str:
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        name = "_".join(f"{field}_{direction}" for field, direction in keys)
+        if name not in self._indexes:
+            index = _Index(name, tuple(field for field, _ in keys), unique)
+            for document in self._documents.values():
+                index.add(document)
+            self._indexes[name] = index
+        return name
+
+    async def drop_index(self, name: str) -> None:
+        self._indexes.pop(name, None)
+
+    async def index_information(self) -> dict:
+        information = {"_id_": {"key": [("_id", 1)]}}
+        for name, index in self._indexes.items():
+            information[name] = {
+                "key": [(field, 1) for field in index.fields],
+                "unique": index.unique,
+            }
+        return information
+
+
+class MemoryDatabase:
+    def __init__(self) -> None:
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name)
+        return self._collections[name]
+
+    def operation_counts(self) -> Dict[str, int]:
+        return {
+            name: collection.operations
+            for name, collection in self._collections.items()
+        }
+
+
+class FakeBot:
+    """Records ``send_message`` calls instead of talking to Telegram."""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.sent: List[Tuple[int, str]] = []
+        self.first_sent_at: Optional[float] = None
+        self.last_sent_at: Optional[float] = None
+
+    async def send_message(self, chat_id: int, text: str, reply_markup=None, **_) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        now = time.perf_counter()
+        if self.first_sent_at is None:
+            self.first_sent_at = now
+        self.last_sent_at = now
+        self.sent.append((chat_id, text))
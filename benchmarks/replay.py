@@ -0,0 +1,205 @@
+"""Replay a journal of recorded updates through the bot's real Application.
+
+Updates journaled with ``UPDATE_JOURNAL`` are fed back through the same
+handlers, with MongoDB and the Telegram API replaced by in-memory stand-ins::
+
+    python -m benchmarks.replay updates.jsonl --speed 10
+    python -m benchmarks.replay updates.jsonl --speed max --users 10000
+
+``--synthesize COUNT`` writes a synthetic journal to the given path first,
+for trying the harness without production traffic.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+# bot.py insists on a MongoDB URI at import time; nothing connects to it here
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("METRICS_PORT", "0")
+
+from telegram import Update  # noqa: E402
+from telegram.request import BaseRequest, RequestData  # noqa: E402
+
+import bot  # noqa: E402
+from benchmarks.bench import reset_bot_state  # noqa: E402
+from benchmarks.corpus import generate_messages, generate_users, make_update  # noqa: E402
+from benchmarks.fakes import MemoryDatabase  # noqa: E402
+from journal import read_journal  # noqa: E402
+from metrics import handler_latency, mongo_latency  # noqa: E402
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Replay", "username": "replay_bot"}
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Answers Bot API calls locally, optionally after a fixed latency."""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+        self._message_ids = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _result(self, method: str, parameters: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "editMessageText"):
+            self._message_ids += 1
+            return {
+                "message_id": parameters.get("message_id", self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": parameters.get("chat_id", 0), "type": "private"},
+                "text": parameters.get("text", ""),
+            }
+        return True
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ) -> Tuple[int, bytes]:
+        started = time.perf_counter()
+        api_method = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.calls[api_method] += 1
+        self.durations[api_method].append(time.perf_counter() - started)
+        body = {"ok": True, "result": self._result(api_method, parameters)}
+        return 200, json.dumps(body).encode()
+
+
+def synthesize_journal(path: str, count: int, rate: float, seed: int = 0) -> None:
+    # Ads and chatter arriving as a Poisson process at `rate` updates/s
+    rng = random.Random(seed)
+    received_at = time.time()
+    with open(path, "w", encoding="utf-8") as journal:
+        for message in generate_messages(bot.service_keywords, count, seed=seed):
+            received_at += rng.expovariate(rate)
+            entry = {"received_at": received_at, "update": make_update(message).to_dict()}
+            journal.write(json.dumps(entry, default=str) + "\n")
+    print(f"wrote {count} synthetic updates to {path}")
+
+
+def _quantile(buckets: List[int], bounds: Tuple[float, ...], count: int, q: float) -> str:
+    # Upper bound of the bucket holding the q-th observation
+    rank = q * count
+    for bound, bucket_count in zip(bounds, buckets):
+        if bucket_count >= rank:
+            return f"<={bound * 1000:g}ms"
+    return f">{bounds[-1] * 1000:g}ms"
+
+
+def report_histogram(title: str, histogram) -> None:
+    snapshot = histogram.snapshot()
+    if not snapshot:
+        return
+    print(title)
+    for key, (buckets, total, count) in sorted(snapshot.items()):
+        if not count:
+            continue
+        name = "/".join(str(value) for value in key)
+        print(
+            f"  {name:<24} {count:>8}  mean {total / count * 1000:8.2f}ms  "
+            f"p50 {_quantile(buckets, histogram.buckets, count, 0.5):>10}  "
+            f"p99 {_quantile(buckets, histogram.buckets, count, 0.99):>10}"
+        )
+
+
+async def replay(
+    entries: List[dict], speed: Optional[float], users: int, latency: float, rate_limit: bool
+) -> None:
+    database = MemoryDatabase()
+    reset_bot_state(database, int(os.getenv("NOTIFY_WORKERS", "8")))
+    await database.users.insert_many(generate_users(bot.available_services, users))
+
+    request = FakeTelegramRequest(latency=latency)
+    application = bot.build_application("0:replay", rate_limit=rate_limit, request=request)
+
+    async with application:
+        await bot.post_init(application)
+        first = entries[0]["received_at"] if entries else 0.0
+        started = time.perf_counter()
+        tasks = []
+        for entry in entries:
+            if speed is not None:
+                delay = (entry["received_at"] - first) / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            update = Update.de_json(entry["update"], application.bot)
+            tasks.append(
+                asyncio.create_task(
+                    application.update_processor.process_update(
+                        update, application.process_update(update)
+                    )
+                )
+            )
+        await asyncio.gather(*tasks)
+        handled = time.perf_counter() - started
+        # Wait for the outbox to drain so sends count towards the run
+        await bot.dispatcher.stop(timeout=None)
+        elapsed = time.perf_counter() - started
+        await bot.post_stop(application)
+    await bot.post_shutdown(application)
+
+    sent = request.calls.get("sendMessage", 0)
+    print(
+        f"replayed {len(entries)} updates in {handled:.2f}s "
+        f"({len(entries) / handled:,.0f} updates/s); "
+        f"{sent} messages sent, all done in {elapsed:.2f}s ({sent / elapsed:,.0f}/s)"
+    )
+    report_histogram("handler latency:", handler_latency)
+    report_histogram("mongo latency:", mongo_latency)
+    print("bot api calls:")
+    for method, durations in sorted(request.durations.items()):
+        print(
+            f"  {method:<24} {len(durations):>8}  "
+            f"mean {sum(durations) / len(durations) * 1000:8.2f}ms"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("journal", help="JSONL journal written via UPDATE_JOURNAL")
+    parser.add_argument(
+        "--speed", default="1", help="replay speed multiplier, or 'max' for no delays"
+    )
+    parser.add_argument("--limit", type=int, help="replay only the first N updates")
+    parser.add_argument("--users", type=int, default=1000, help="synthetic subscribers")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake API latency (s)")
+    parser.add_argument(
+        "--rate-limit", action="store_true", help="keep the AIORateLimiter enabled"
+    )
+    parser.add_argument("--synthesize", type=int, metavar="COUNT")
+    parser.add_argument("--rate", type=float, default=20.0, help="synthetic updates/s")
+    args = parser.parse_args()
+
+    # Per-notification info logs would dominate the measurements
+    logging.disable(logging.INFO)
+
+    if args.synthesize:
+        synthesize_journal(args.journal, args.synthesize, args.rate)
+    speed = None if args.speed == "max" else float(args.speed)
+    entries = list(read_journal(args.journal, args.limit))
+    asyncio.run(replay(entries, speed, args.users, args.latency, args.rate_limit))
+
+
+if __name__ == "__main__":
+    main()
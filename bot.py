@@ -1,13 +1,16 @@
 import logging
 import os
+import secrets
 from datetime import datetime, timedelta
+from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from dotenv import load_dotenv
 from telegram import (
     Update,
     Chat,
     BotCommand,
-    InlineKeyboardButton,
     InlineKeyboardMarkup,
 )
 from telegram.ext import (
@@ -17,7 +20,42 @@ from telegram.ext import (
     filters,
     CallbackContext,
     CallbackQueryHandler,
+    AIORateLimiter,
+    TypeHandler,
 )
+from telegram.request import BaseRequest
+
+from cache import UserCache
+from dedup import NearDuplicateIndex
+from digest import DigestBuffer
+from dispatcher import (
+    NotificationDispatcher,
+    Outbox,
+    make_digest_notification,
+    make_notification,
+)
+from journal import UpdateJournal
+from keyboards import CallbackCodec, ServiceKeyboard
+from matcher import KeywordMatcher
+from metrics import (
+    CallbackMetric,
+    MetricsServer,
+    MongoCommandListener,
+    handler_latency,
+    mongo_latency,
+    recipients_per_message,
+    registry,
+    service_matches,
+)
+from processing import PerUserCallbackProcessor
+from storage import (
+    BatchWriter,
+    ensure_indexes,
+    merge_duplicate_users,
+    migrate_message_identity,
+    migrate_trial_dates,
+)
+from subscribers import SubscriberIndex
 
 # Load environment variables from .env file
 load_dotenv()
@@ -34,185 +72,355 @@ if not MONGO_URI:
     logger.error("MONGO_URI is not set in the environment variables.")
     raise ValueError("MONGO_URI is not set in the environment variables.")
 
-client = AsyncIOMotorClient(MONGO_URI)
+client = AsyncIOMotorClient(
+    MONGO_URI, event_listeners=[MongoCommandListener(mongo_latency)]
+)
 db = client.telegram_bot
 collection = db.collected_data
 user_collection = db.users  # Collection to store private chat user IDs
 notification_collection = db.notifications  # Collection to track notifications
-
-# Initial service state (default is off)
-service_state = {
-    service: False
-    for service in [
-        "Renters Real Estate",
-        "Sellers Real Estate",
-        "Landlords Real Estate",
-        "Currency and Crypto Exchange",
-        "Buyers Real Estate",
-        "Residence Permit",
-        "Short-Term Renters",
-        "Room or Hostel Renters",
-        "Owners Real Estate",
-        "AI - Renters Real Estate",
-        "Renters Cars",
-        "Landlords Cars",
-        "Transfer",
-        "Bike Rentals",
-        "Yacht Rentals",
-        "Excursions",
-        "Massage",
-        "Cleaning",
-        "Photography",
-        "Insurance",
-        "Manicure",
-    ]
+outbox_collection = db.outbox  # Pending notifications, survives restarts
+migration_collection = db.migrations  # One-off migrations that already ran
+
+# Services users can subscribe to, in keyboard order
+available_services = [
+    "Renters Real Estate",
+    "Sellers Real Estate",
+    "Landlords Real Estate",
+    "Currency and Crypto Exchange",
+    "Buyers Real Estate",
+    "Residence Permit",
+    "Short-Term Renters",
+    "Room or Hostel Renters",
+    "Owners Real Estate",
+    "AI - Renters Real Estate",
+    "Renters Cars",
+    "Landlords Cars",
+    "Transfer",
+    "Bike Rentals",
+    "Yacht Rentals",
+    "Excursions",
+    "Massage",
+    "Cleaning",
+    "Photography",
+    "Insurance",
+    "Manicure",
+]
+
+
+# Keywords per language; all of them compile into one matcher (see normalize.py)
+service_keywords = {
+    "Renters Real Estate": {
+        "en": [
+            "for rent",
+            "rental",
+            "rent",
+            "available for rent",
+            "leasing",
+            "rental property",
+            "for lease",
+            "rental unit",
+        ],
+        "ru": ["сдается", "сдаётся", "сдаю", "аренда", "в аренду"],
+        "ka": ["ქირავდება", "ქირით"],
+    },
+    "Sellers Real Estate": {
+        "en": [
+            "for sale",
+            "selling",
+            "buy property",
+            "house for sale",
+            "property for sale",
+        ],
+        "ru": ["продается", "продаётся", "продаю", "продам"],
+        "ka": ["იყიდება"],
+    },
+    "Landlords Real Estate": {
+        "en": [
+            "landlord",
+            "landlord needed",
+            "rent out",
+            "property management",
+        ],
+        "ru": ["сдам", "арендодатель"],
+        "ka": ["გავაქირავებ"],
+    },
+    "Currency and Crypto Exchange": {
+        "en": [
+            "currency exchange",
+            "crypto exchange",
+            "buy bitcoin",
+            "sell bitcoin",
+            "forex",
+            "crypto trading",
+        ],
+        "ru": ["обмен валют", "обмен валюты", "обмен крипты", "куплю биткоин"],
+        "ka": ["ვალუტის გადაცვლა"],
+    },
+    "Buyers Real Estate": {
+        "en": [
+            "buy house",
+            "buy property",
+            "property purchase",
+            "real estate investment",
+        ],
+        "ru": ["куплю квартиру", "куплю дом"],
+        "ka": ["ვიყიდი ბინას"],
+    },
+    "Residence Permit": {
+        "en": [
+            "residence permit",
+            "visa",
+            "immigration",
+            "work permit",
+            "residency",
+        ],
+        "ru": ["вид на жительство", "внж", "виза", "визу", "разрешение на работу"],
+        "ka": ["ბინადრობის ნებართვა", "ვიზა"],
+    },
+    "Short-Term Renters": {
+        "en": [
+            "short-term rental",
+            "vacation rental",
+            "holiday home",
+            "airbnb",
+            "temporary accommodation",
+        ],
+        "ru": ["посуточно", "посуточная аренда"],
+        "ka": ["დღიურად"],
+    },
+    "Room or Hostel Renters": {
+        "en": [
+            "room for rent",
+            "hostel",
+            "shared accommodation",
+            "hostel vacancy",
+            "roommate needed",
+        ],
+        "ru": ["сдается комната", "хостел", "койко место"],
+        "ka": ["ოთახი ქირავდება", "ჰოსტელი"],
+    },
+    "Owners Real Estate": {
+        "en": [
+            "property owner",
+            "own property",
+            "real estate owner",
+            "own house",
+            "property portfolio",
+        ],
+        "ru": ["собственник"],
+        "ka": ["მესაკუთრე"],
+    },
+    "AI - Renters Real Estate": {
+        "en": [
+            "ai rental",
+            "ai real estate",
+            "smart rental",
+            "ai property management",
+        ],
+    },
+    "Renters Cars": {
+        "en": [
+            "car rental",
+            "rent a car",
+            "car lease",
+            "vehicle rental",
+            "rental car available",
+        ],
+        "ru": ["аренда авто", "аренда машины", "прокат авто"],
+        "ka": ["მანქანის ქირაობა"],
+    },
+    "Landlords Cars": {
+        "en": ["rent out car", "car lease", "car available for rent"],
+        "ru": ["сдам авто", "сдам машину"],
+    },
+    "Transfer": {
+        "en": [
+            "airport transfer",
+            "shuttle service",
+            "transport service",
+            "pickup and drop",
+            "travel transfer",
+        ],
+        "ru": ["трансфер из аэропорта", "трансфер в аэропорт"],
+        "ka": ["ტრანსფერი"],
+    },
+    "Bike Rentals": {
+        "en": ["bike rental", "rent a bike", "bicycle rental", "bike hire"],
+        "ru": ["аренда велосипеда", "прокат велосипедов"],
+        "ka": ["ველოსიპედის ქირაობა"],
+    },
+    "Yacht Rentals": {
+        "en": [
+            "yacht rental",
+            "rent a yacht",
+            "boat rental",
+            "yacht hire",
+            "luxury boat rental",
+        ],
+        "ru": ["аренда яхты", "прокат яхт"],
+        "ka": ["იახტის ქირაობა"],
+    },
+    "Excursions": {
+        "en": [
+            "excursion",
+            "guided tour",
+            "day trip",
+            "sightseeing tour",
+            "tourist attraction",
+        ],
+        "ru": ["экскурсия", "экскурсии"],
+        "ka": ["ექსკურსია"],
+    },
+    "Massage": {
+        "en": [
+            "massage service",
+            "spa treatment",
+            "therapeutic massage",
+            "relaxation massage",
+        ],
+        "ru": ["массаж"],
+        "ka": ["მასაჟი"],
+    },
+    "Cleaning": {
+        "en": [
+            "cleaning service",
+            "house cleaning",
+            "office cleaning",
+            "maid service",
+            "deep cleaning",
+        ],
+        "ru": ["уборка квартир", "клининг"],
+        "ka": ["დალაგება"],
+    },
+    "Photography": {
+        "en": [
+            "photography service",
+            "event photography",
+            "portrait photography",
+            "photo shoot",
+            "professional photographer",
+        ],
+        "ru": ["фотограф", "фотосессия"],
+        "ka": ["ფოტოგრაფი", "ფოტოსესია"],
+    },
+    "Insurance": {
+        "en": [
+            "insurance",
+            "life insurance",
+            "health insurance",
+            "car insurance",
+            "property insurance",
+        ],
+        "ru": ["страховка", "страхование"],
+        "ka": ["დაზღვევა"],
+    },
+    "Manicure": {
+        "en": ["manicure", "nail salon", "nail treatment", "nail care", "nail art"],
+        "ru": ["маникюр"],
+        "ka": ["მანიკური"],
+    },
 }
 
-
-service_keywords = {
+# Phrases that cancel a keyword match inside them ("visa" in "visa card")
+keyword_exclusions = {
     "Renters Real Estate": [
-        "for rent",
-        "rental",
-        "rent",
-        "available for rent",
-        "leasing",
-        "rental property",
-        "for lease",
-        "rental unit",
-    ],
-    "Sellers Real Estate": [
-        "for sale",
-        "selling",
-        "buy property",
-        "house for sale",
-        "property for sale",
-    ],
-    "Landlords Real Estate": [
-        "landlord",
-        "landlord needed",
-        "rent out",
-        "property management",
-    ],
-    "Currency and Crypto Exchange": [
-        "currency exchange",
-        "crypto exchange",
-        "buy bitcoin",
-        "sell bitcoin",
-        "forex",
-        "crypto trading",
-    ],
-    "Buyers Real Estate": [
-        "buy house",
-        "buy property",
-        "property purchase",
-        "real estate investment",
-    ],
-    "Residence Permit": [
-        "residence permit",
-        "visa",
-        "immigration",
-        "work permit",
-        "residency",
-    ],
-    "Short-Term Renters": [
-        "short-term rental",
-        "vacation rental",
-        "holiday home",
-        "airbnb",
-        "temporary accommodation",
-    ],
-    "Room or Hostel Renters": [
-        "room for rent",
-        "hostel",
-        "shared accommodation",
-        "hostel vacancy",
-        "roommate needed",
-    ],
-    "Owners Real Estate": [
-        "property owner",
-        "own property",
-        "real estate owner",
-        "own house",
-        "property portfolio",
-    ],
-    "AI - Renters Real Estate": [
-        "ai rental",
-        "ai real estate",
-        "smart rental",
-        "ai property management",
-    ],
-    "Renters Cars": [
-        "car rental",
         "rent a car",
-        "car lease",
-        "vehicle rental",
-        "rental car available",
+        "car for rent",
+        "bike for rent",
+        "аренда авто",
+        "аренда машины",
     ],
-    "Landlords Cars": ["rent out car", "car lease", "car available for rent"],
-    "Transfer": [
-        "airport transfer",
-        "shuttle service",
-        "transport service",
-        "pickup and drop",
-        "travel transfer",
-    ],
-    "Bike Rentals": ["bike rental", "rent a bike", "bicycle rental", "bike hire"],
-    "Yacht Rentals": [
-        "yacht rental",
-        "rent a yacht",
-        "boat rental",
-        "yacht hire",
-        "luxury boat rental",
-    ],
-    "Excursions": [
-        "excursion",
-        "guided tour",
-        "day trip",
-        "sightseeing tour",
-        "tourist attraction",
-    ],
-    "Massage": [
-        "massage service",
-        "spa treatment",
-        "therapeutic massage",
-        "relaxation massage",
-    ],
-    "Cleaning": [
-        "cleaning service",
-        "house cleaning",
-        "office cleaning",
-        "maid service",
-        "deep cleaning",
-    ],
-    "Photography": [
-        "photography service",
-        "event photography",
-        "portrait photography",
-        "photo shoot",
-        "professional photographer",
-    ],
-    "Insurance": [
-        "insurance",
-        "life insurance",
-        "health insurance",
-        "car insurance",
-        "property insurance",
+    "Residence Permit": [
+        "visa card",
+        "visa debit",
+        "visa credit",
+        "visa gold",
+        "visa platinum",
     ],
-    "Manicure": ["manicure", "nail salon", "nail treatment", "nail care", "nail art"],
 }
 
+# Compiled once; call keyword_matcher.update(service_keywords, keyword_exclusions)
+# after changing keywords
+keyword_matcher = KeywordMatcher(service_keywords, keyword_exclusions)
 
-def generate_service_keyboard() -> InlineKeyboardMarkup:
-    keyboard = []
-    for service, is_on in service_state.items():
-        color = "🟢" if is_on else "🔴"
-        button_text = f"{color} {service}"
-        callback_data = f"{service}_on" if not is_on else f"{service}_off"
-        button = InlineKeyboardButton(button_text, callback_data=callback_data)
-        keyboard.append([button])
-    return InlineKeyboardMarkup(keyboard)
+# New services go at the end: callback_data refers to them by position
+callback_codec = CallbackCodec(available_services)
+service_keyboard = ServiceKeyboard(available_services, callback_codec)
 
+# user_id -> status, services and trial end; invalidated on every write
+user_cache = UserCache(
+    user_collection,
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "300")),
+)
 
+# service -> user_ids, loaded on startup and kept in sync by the handlers
+subscriber_index = SubscriberIndex()
+
+# Collected messages are written in batches, off the notification path
+batch_writer = BatchWriter(
+    collection,
+    max_batch=int(os.getenv("COLLECT_BATCH_SIZE", "100")),
+    flush_interval=float(os.getenv("COLLECT_FLUSH_INTERVAL", "1.0")),
+)
+
+# Recently stored ads, so cross-posted copies are stored and sent only once
+near_duplicates = NearDuplicateIndex(
+    window=float(os.getenv("NEAR_DUP_WINDOW", str(6 * 60 * 60))),
+    max_distance=int(os.getenv("NEAR_DUP_DISTANCE", "6")),
+)
+
+# Matches waiting to be sent to digest-mode users as one combined message
+digest_buffer = DigestBuffer(
+    db.digest_items, max_items=int(os.getenv("DIGEST_MAX_ITEMS", "20"))
+)
+
+# Outbound notification queue, drained by a pool of workers
+dispatcher = NotificationDispatcher(
+    Outbox(outbox_collection),
+    notification_collection,
+    workers=int(os.getenv("NOTIFY_WORKERS", "8")),
+    max_queue=int(os.getenv("NOTIFY_QUEUE_SIZE", "10000")),
+)
+
+
+# Point every component at another database, e.g. the in-memory stand-in
+# used by the benchmarks and the replay tool
+def bind_database(database) -> None:
+    global db, collection, user_collection, notification_collection, outbox_collection
+    global migration_collection
+    db = database
+    collection = database.collected_data
+    user_collection = database.users
+    notification_collection = database.notifications
+    outbox_collection = database.outbox
+    migration_collection = database.migrations
+    batch_writer.collection = collection
+    digest_buffer.collection = database.digest_items
+    user_cache.collection = user_collection
+    dispatcher.outbox.collection = outbox_collection
+    dispatcher.delivered_collection = notification_collection
+
+
+# Trial ends at midnight (UTC) `days` from today, stored as a BSON datetime
+def trial_end_in_days(days: int) -> datetime:
+    return datetime.combine(
+        (datetime.utcnow() + timedelta(days=days)).date(), datetime.min.time()
+    )
+
+
+def trial_expired(user: dict, now: datetime) -> bool:
+    trial_end_date = user.get("trial_end_date")
+    return isinstance(trial_end_date, datetime) and trial_end_date <= now
+
+
+def generate_service_keyboard(selected_services) -> InlineKeyboardMarkup:
+    # Markups are prebuilt and cached per selection
+    return service_keyboard.render(selected_services)
+
+
+@handler_latency.time(handler="start")
 async def start(update: Update, _: CallbackContext) -> None:
     user = update.message.from_user
     chat_type = update.message.chat.type
@@ -224,27 +432,63 @@ async def start(update: Update, _: CallbackContext) -> None:
     user_id = user.id
 
     if chat_type == Chat.PRIVATE:
-        # Check if the user is already in the database
-        user_data = await user_collection.find_one({"user_id": user_id})
-        if user_data is None:
-            trial_end_date = (datetime.utcnow() + timedelta(days=3)).strftime("%Y-%m-%d")
-
-            await user_collection.insert_one(
-                {
-                    "username": username,
-                    "first_name": first_name,
-                    "last_name": last_name,
-                    "user_id": user_id,
-                    "status": True,  # Set status to True for active
-                    "trial_end_date": trial_end_date,
-                    "services": [],  # Store the selected services
+        # One round trip registers new users and reactivates users that had
+        # blocked the bot; the fields of existing users are otherwise kept
+        user_data = {
+            "username": username,
+            "first_name": first_name,
+            "last_name": last_name,
+            "user_id": user_id,
+            "status": True,  # Set status to True for active
+            "trial_end_date": trial_end_in_days(3),
+            "services": [],  # Store the selected services
+        }
+        registration = [
+            {
+                "$set": {
+                    **{
+                        field: {"$ifNull": [f"${field}", value]}
+                        for field, value in user_data.items()
+                    },
+                    "status": {
+                        "$cond": [
+                            {"$eq": ["$unreachable", True]},
+                            True,
+                            {"$ifNull": ["$status", True]},
+                        ]
+                    },
                 }
+            },
+            {"$unset": "unreachable"},
+        ]
+        try:
+            before = await user_collection.find_one_and_update(
+                {"user_id": user_id},
+                registration,
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
             )
+            created = before is None
+        except DuplicateKeyError:
+            # A concurrent /start inserted the user first
+            before, created = None, False
+
+        if created:
+            user_cache.put(user_data)
+            subscriber_index.set_services(user_id, [])
             logger.info(f"Added user {user_id} to the database with status 'True'.")
             await update.message.reply_text(
                 "Hello! I'm a bot that collects text from groups. You have a 3-day free trial."
             )
         else:
+            # Coming back after blocking the bot reactivates the account
+            if before is not None and before.get("unreachable"):
+                reactivated = {**before, "status": True}
+                reactivated.pop("unreachable")
+                dispatcher.mark_reachable(user_id)
+                user_cache.put(reactivated)
+                subscriber_index.set_services(user_id, reactivated.get("services", []))
+                logger.info(f"User {user_id} is reachable again.")
             logger.info(f"User {user_id} already registered.")
             await update.message.reply_text(
                 "You have already started. I'm here to collect text from groups."
@@ -252,59 +496,122 @@ async def start(update: Update, _: CallbackContext) -> None:
 
 
 async def services(update: Update, _: CallbackContext) -> None:
-    reply_markup = generate_service_keyboard()
+    user_data = await user_cache.get(update.message.from_user.id)
+    selected_services = user_data.get("services", []) if user_data else []
+    reply_markup = generate_service_keyboard(selected_services)
     await update.message.reply_text(
         "Please choose a service:", reply_markup=reply_markup
     )
 
 
-async def button(update: Update, context: CallbackContext) -> None:
-    query = update.callback_query
-    user = query.from_user
-    user_data = await user_collection.find_one({"user_id": user.id})
+async def digest(update: Update, _: CallbackContext) -> None:
+    # Toggle between one message per ad and periodic digests
+    user_data = await user_collection.find_one_and_update(
+        {"user_id": update.message.from_user.id},
+        [{"$set": {"digest": {"$not": [{"$ifNull": ["$digest", False]}]}}}],
+        return_document=ReturnDocument.AFTER,
+    )
+    if user_data is None:
+        await update.message.reply_text("Please send /start first.")
+        return
 
-    service_name, status = query.data.rsplit("_", 1)
+    user_cache.put(user_data)
+    if user_data["digest"]:
+        await update.message.reply_text(
+            "Digest mode is on: matching posts will be sent together "
+            f"every {digest_interval() // 60} minutes."
+        )
+    else:
+        await update.message.reply_text(
+            "Digest mode is off: matching posts will be sent right away."
+        )
 
-    if status == "on":
-        service_state[service_name] = True
 
-        # Update user's selected services and adjust trial period
-        selected_services = user_data.get("services", [])
-        selected_services.append(service_name)
+def digest_interval() -> int:
+    return int(os.getenv("DIGEST_INTERVAL", "1800"))
+
+
+# Add the service (like $addToSet, keeping the list order) and adjust the
+# trial period from the resulting number of services, in one atomic update
+async def subscribe(user_id: int, service_name: str):
+    current = {"$ifNull": ["$services", []]}
+    return await user_collection.find_one_and_update(
+        {"user_id": user_id},
+        [
+            {
+                "$set": {
+                    "services": {
+                        "$cond": [
+                            {"$in": [service_name, current]},
+                            current,
+                            {"$concatArrays": [current, [service_name]]},
+                        ]
+                    }
+                }
+            },
+            {
+                "$set": {
+                    "trial_end_date": {
+                        "$cond": [
+                            {"$eq": [{"$size": "$services"}, 1]},
+                            trial_end_in_days(3),
+                            datetime.utcnow().replace(
+                                hour=23, minute=59, second=59, microsecond=0
+                            ),
+                        ]
+                    }
+                }
+            },
+        ],
+        return_document=ReturnDocument.AFTER,
+    )
 
-        if len(selected_services) == 1:
-            trial_end_date = (datetime.utcnow() + timedelta(days=3)).strftime("%Y-%m-%d")
-        else:
-            trial_end_date = (
-                datetime.utcnow()
-                .replace(hour=23, minute=59, second=59)
-                .strftime("%Y-%m-%d %H:%M:%S")
-            )
 
-        await user_collection.update_one(
-            {"user_id": user.id},
-            {"$set": {"services": selected_services, "trial_end_date": trial_end_date}},
-        )
-        
-    elif status == "off":
-        service_state[service_name] = False
+async def unsubscribe(user_id: int, service_name: str):
+    return await user_collection.find_one_and_update(
+        {"user_id": user_id},
+        {"$pull": {"services": service_name}},
+        return_document=ReturnDocument.AFTER,
+    )
 
-        # Update user's selected services
-        selected_services = user_data.get("services", [])
-        if service_name in selected_services:
-            selected_services.remove(service_name)
 
-        await user_collection.update_one(
-            {"user_id": user.id}, {"$set": {"services": selected_services}}
-        )
+# Decoded callback action -> handler returning the updated user document
+callback_actions = {
+    "on": subscribe,
+    "off": unsubscribe,
+}
+
+
+@handler_latency.time(handler="button")
+async def button(update: Update, context: CallbackContext) -> None:
+    query = update.callback_query
+    user = query.from_user
+
+    decoded = callback_codec.decode(query.data)
+    action = callback_actions.get(decoded[0]) if decoded else None
+    if action is None:
+        await query.answer()
+        return
+
+    user_data = await action(user.id, decoded[1])
+    if user_data is None:
+        await query.answer("Please send /start first.")
+        return
+    user_cache.put(user_data)
+
+    selected_services = user_data.get("services", [])
+    if user_data.get("status"):
+        subscriber_index.set_services(user.id, selected_services)
 
     await query.answer()
     await query.edit_message_text(
-        text="choose service", reply_markup=generate_service_keyboard()
+        text="choose service",
+        reply_markup=generate_service_keyboard(selected_services),
     )
 
 
 # Function to collect data from the group
+@handler_latency.time(handler="collect_data")
 async def collect_data(update: Update, context: CallbackContext) -> None:
     user = update.message.from_user
     chat = update.message.chat
@@ -314,89 +621,298 @@ async def collect_data(update: Update, context: CallbackContext) -> None:
     if not text:
         return
 
-    text_lower = text.lower()
-
-    # Determine if the text matches any keywords for the active services
-    matched_services = []
-    for service, keywords in service_keywords.items():
-        if service_state.get(service, False) and any(keyword in text_lower for keyword in keywords):
-            matched_services.append(service)
+    # Determine if the text matches any keywords for the services that at
+    # least one active user is subscribed to
+    matched_services = [
+        service
+        for service in keyword_matcher.match(text)
+        if subscriber_index.is_watched(service)
+    ]
 
     if not matched_services:
         return
+    for service in matched_services:
+        service_matches.inc(service=service)
 
     if chat.username:
         message_link = f"https://t.me/{chat.username}/{update.message.message_id}"
     else:
         message_link = f"https://t.me/{chat_name}/{update.message.message_id}"
 
+    # A copy of a recent ad only adds its link to the stored record;
+    # subscribers were already notified about the original
+    fingerprint, token_count = near_duplicates.fingerprint(text)
+    original_id = near_duplicates.find(fingerprint, token_count)
+    if original_id is not None:
+        batch_writer.update(
+            {"_id": original_id}, {"$addToSet": {"source_links": message_link}}
+        )
+        logger.info(f"Near-duplicate of {original_id} from {chat_name}, not resent.")
+        return
+
     user_link = f"https://t.me/{user.username}" if user.username else None
 
     collected_data = {
+        "_id": ObjectId(),
         "user_link": user_link,
         "text": text,
         "message_link": message_link,
+        "source_links": [message_link],
+        "fingerprint": f"{fingerprint:016x}",
         "chat_name": chat_name,
+        "chat_id": chat.id,
         "message_id": update.message.message_id,
         "matched_services": matched_services
     }
 
+    near_duplicates.add(fingerprint, collected_data["_id"])
+    batch_writer.add(collected_data)
     try:
-        await collection.insert_one(collected_data)
-        logger.info("Data inserted successfully.")
         await notify_users(context, collected_data)
     except Exception as e:
-        logger.error(f"Error saving data to MongoDB: {e}")
+        logger.error(f"Error notifying users: {e}")
 
 
 # Function to notify users about new data
+@handler_latency.time(handler="notify_users")
 async def notify_users(context: CallbackContext, data: dict) -> None:
     summary = f"{data.get('text', 'No text')}"
     buttons = []
     if data.get("user_link"):
-        buttons.append(InlineKeyboardButton(text="User Link", url=data["user_link"]))
+        buttons.append(("User Link", data["user_link"]))
     if data.get("message_link"):
-        buttons.append(
-            InlineKeyboardButton(text="Message Link", url=data["message_link"])
+        buttons.append(("Message Link", data["message_link"]))
+
+    # Only look at users subscribed to one of the matched services
+    recipients = subscriber_index.recipients(data.get("matched_services", []))
+    if not recipients:
+        return
+
+    # Only notify active users whose trial hasn't ended; expire_trials
+    # deactivates the expired ones in the background
+    now = datetime.utcnow()
+    users = await user_cache.get_many(recipients)
+    candidates = [
+        user_id
+        for user_id, user in users.items()
+        if user.get("status") and not trial_expired(user, now)
+    ]
+
+    if not candidates:
+        return
+
+    # One round trip to skip everyone who already got this message
+    already_notified = {
+        notification["user_id"]
+        async for notification in notification_collection.find(
+            {
+                "chat_id": data["chat_id"],
+                "message_id": data["message_id"],
+                "user_id": {"$in": candidates},
+            },
+            {"user_id": 1},
         )
-    reply_markup = InlineKeyboardMarkup([[*buttons]])
-
-    async for user in user_collection.find(
-        {"status": True}
-    ):  # Only notify active users
-        user_id = user["user_id"]
-        trial_end_date_str = user.get("trial_end_date")
-        if trial_end_date_str:
-            try:
-                trial_end_date = datetime.strptime(
-                    trial_end_date_str, "%Y-%m-%d %H:%M:%S"
-                )
-            except ValueError:
-                trial_end_date = datetime.strptime(trial_end_date_str, "%Y-%m-%d")
-            if datetime.utcnow() >= trial_end_date:
-                await user_collection.update_one(
-                    {"user_id": user_id}, {"$set": {"status": False}}
-                )  # Update to False when trial ends
-                logger.info(
-                    f"User {user_id} trial period ended. Status changed to 'False'."
+    }
+    pending, digest_users = [], []
+    for user_id in candidates:
+        if user_id in already_notified:
+            continue
+        if users[user_id].get("digest"):
+            digest_users.append(user_id)
+        else:
+            pending.append(
+                make_notification(
+                    user_id, data["chat_id"], data["message_id"], summary, buttons
                 )
-                continue
+            )
 
-        if await notification_collection.find_one(
-            {"user_id": user_id, "message_id": data["message_id"]}
-        ):
-            continue
+    recipients_per_message.observe(len(candidates) - len(already_notified))
 
-        try:
-            await context.bot.send_message(
-                chat_id=user_id, text=summary, reply_markup=reply_markup
-            )
-            logger.info(f"Notification sent to user {user_id}.")
-            await notification_collection.insert_one(
-                {"user_id": user_id, "message_id": data["message_id"]}
+    # Digest users get it with the next flush_digests run, or right away once
+    # their buffer is full; buffered items are stored, not kept in memory
+    full = await digest_buffer.add(digest_users, data)
+
+    # Written to the outbox in one batch, delivered by the dispatcher workers
+    await dispatcher.submit(pending)
+    for user_id in full:
+        await send_digests(user_id)
+
+
+def render_digest(user_id: int, items: list) -> list:
+    return [
+        make_digest_notification(user_id, text, covered)
+        for text, covered in digest_buffer.render(items)
+    ]
+
+
+async def send_digests(user_id: int = None) -> int:
+    # Moves buffered items of one user (or everyone) into the outbox
+    async with digest_buffer.lock:
+        pending_items = await digest_buffer.pending(user_id)
+        notifications = [
+            notification
+            for user, items in pending_items.items()
+            for notification in render_digest(user, items)
+        ]
+        if notifications:
+            await dispatcher.submit(notifications)
+            # Only once the digests are safely in the outbox
+            await digest_buffer.remove(
+                [item for items in pending_items.values() for item in items]
             )
-        except Exception as e:
-            logger.error(f"Error sending notification to user {user_id}: {e}")
+    return len(notifications)
+
+
+# Periodic job: send every pending digest
+async def flush_digests(_: CallbackContext) -> None:
+    sent = await send_digests()
+    if sent:
+        logger.info(f"Queued {sent} digest messages.")
+
+
+# Metrics read from the components' own counters at scrape time
+registry.register(
+    CallbackMetric(
+        "bot_send_failures_total",
+        "Failed send attempts by Telegram error type.",
+        lambda: {(error,): count for error, count in dispatcher.errors.items()},
+        ["error"],
+        type="counter",
+    )
+)
+registry.register(
+    CallbackMetric(
+        "bot_notifications_total",
+        "Notifications by outcome.",
+        lambda: {
+            ("sent",): dispatcher.sent,
+            ("failed",): dispatcher.failed,
+            ("skipped_unreachable",): dispatcher.skipped_unreachable,
+        },
+        ["outcome"],
+        type="counter",
+    )
+)
+registry.register(
+    CallbackMetric(
+        "bot_notification_queue_depth",
+        "Outbox entries waiting for a dispatcher worker.",
+        lambda: {(): dispatcher.queue_depth},
+    )
+)
+registry.register(
+    CallbackMetric(
+        "bot_user_cache_requests_total",
+        "User cache lookups by result.",
+        lambda: {("hit",): user_cache.hits, ("miss",): user_cache.misses},
+        ["result"],
+        type="counter",
+    )
+)
+registry.register(
+    CallbackMetric(
+        "bot_digest_pending_items",
+        "Matches buffered for digest-mode users.",
+        lambda: {(): len(digest_buffer)},
+    )
+)
+
+metrics_server = MetricsServer(
+    registry,
+    host=os.getenv("METRICS_HOST", "127.0.0.1"),
+    port=int(os.getenv("METRICS_PORT", "9102")),
+)
+
+
+# Periodic job: deactivate every user whose trial has ended
+async def expire_trials(_: CallbackContext) -> None:
+    expired = {"status": True, "trial_end_date": {"$lte": datetime.utcnow()}}
+    user_ids = [
+        user["user_id"] async for user in user_collection.find(expired, {"user_id": 1})
+    ]
+    if not user_ids:
+        return
+
+    await user_collection.update_many(
+        {**expired, "user_id": {"$in": user_ids}}, {"$set": {"status": False}}
+    )
+    for user_id in user_ids:
+        subscriber_index.drop_user(user_id)
+        user_cache.invalidate(user_id)
+    logger.info(
+        f"Trial period ended for {len(user_ids)} users. Status changed to 'False'."
+    )
+
+
+# Called by the dispatcher with users that blocked the bot or no longer exist
+async def deactivate_unreachable(user_ids: list) -> None:
+    await user_collection.update_many(
+        {"user_id": {"$in": user_ids}},
+        {"$set": {"status": False, "unreachable": True}},
+    )
+    for user_id in user_ids:
+        subscriber_index.drop_user(user_id)
+        user_cache.invalidate(user_id)
+    logger.info(f"Deactivated {len(user_ids)} users that blocked the bot.")
+
+
+# Load in-memory state before the bot starts receiving updates
+async def post_init(application: Application) -> None:
+    migrated = await migrate_message_identity(
+        collection, notification_collection, outbox_collection, migration_collection
+    )
+    if migrated:
+        logger.info(f"Added chat_id to {migrated} legacy documents.")
+
+    migrated = await migrate_trial_dates(user_collection, migration_collection)
+    if migrated:
+        logger.info(f"Converted trial_end_date to datetime for {migrated} users.")
+
+    merged = await merge_duplicate_users(user_collection)
+    if merged:
+        logger.info(f"Removed {merged} duplicate user documents.")
+
+    created = await ensure_indexes(
+        collection,
+        user_collection,
+        notification_collection,
+        outbox_collection,
+        digest_buffer.collection,
+        notification_ttl_days=int(os.getenv("NOTIFICATION_TTL_DAYS", "30")),
+    )
+    if created:
+        logger.info(f"Created indexes: {', '.join(created)}")
+    else:
+        logger.info("All indexes already exist.")
+
+    count = await subscriber_index.load(user_collection)
+    logger.info(f"Subscriber index loaded for {count} active users.")
+    count = await digest_buffer.load()
+    if count:
+        logger.info(f"{count} digest items are waiting from the previous run.")
+    await batch_writer.start()
+    if metrics_server.port:
+        await metrics_server.start()
+        logger.info(f"Serving metrics on port {metrics_server.port}.")
+    await dispatcher.start(application.bot, on_unreachable=deactivate_unreachable)
+
+
+async def post_stop(_: Application) -> None:
+    # Runs before Application.shutdown() closes the bot's HTTP client, so the
+    # queue drains while sends still work. Buffered digest items are stored
+    # and wait for the next run's flush.
+    await dispatcher.stop()
+
+
+async def post_shutdown(application: Application) -> None:
+    await batch_writer.stop()
+    await metrics_server.stop()
+    logger.info(f"Notification dispatcher stopped: {dispatcher.stats()}")
+    logger.info(f"User cache: {user_cache.stats()}")
+    journal = application.bot_data.get("journal")
+    if journal is not None:
+        journal.close()
+        logger.info(f"Journaled {journal.recorded} updates to {journal.path}.")
 
 
 # Error handler
@@ -404,27 +920,98 @@ async def error(update: Update, context: CallbackContext) -> None:
     logger.warning(f"Update {update} caused error {context.error}")
 
 
-def main() -> None:
-    bot_token = os.getenv("BOT_TOKEN")
-    if not bot_token:
-        logger.error("BOT_TOKEN is not set in the environment variables.")
-        raise ValueError("BOT_TOKEN is not set in the environment variables.")
+def run_webhook(application: Application) -> None:
+    webhook_url = os.getenv("WEBHOOK_URL")
+    if not webhook_url:
+        logger.error("WEBHOOK_URL is not set in the environment variables.")
+        raise ValueError("WEBHOOK_URL is not set in the environment variables.")
 
-    application = Application.builder().token(bot_token).build()
+    url_path = os.getenv("WEBHOOK_PATH", "telegram")
+    # Telegram echoes the secret back in every request so forged updates are rejected
+    secret_token = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+
+    application.run_webhook(
+        listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8443")),
+        url_path=url_path,
+        webhook_url=f"{webhook_url.rstrip('/')}/{url_path}",
+        secret_token=secret_token,
+        max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40")),
+    )
+
+
+def build_application(
+    bot_token: str,
+    rate_limit: bool = True,
+    request: BaseRequest = None,
+    journal_path: str = None,
+) -> Application:
+    builder = (
+        Application.builder()
+        .token(bot_token)
+        # Updates run concurrently; one user's button presses stay in order
+        .concurrent_updates(
+            PerUserCallbackProcessor(int(os.getenv("UPDATE_CONCURRENCY", "64")))
+        )
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if rate_limit:
+        # AIORateLimiter keeps us under Telegram's global and per-chat limits
+        builder = builder.rate_limiter(AIORateLimiter())
+    if request is not None:
+        # E.g. a stand-in for the Telegram API when replaying updates
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
+
+    # Record every raw update before any handler sees it
+    if journal_path:
+        journal = UpdateJournal(journal_path)
+        application.add_handler(TypeHandler(Update, journal.record), group=-1)
+        application.bot_data["journal"] = journal
+        logger.info(f"Journaling updates to {journal_path}.")
 
     # Add handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("services", services))
+    application.add_handler(CommandHandler("digest", digest))
     application.add_handler(CallbackQueryHandler(button))
     application.add_handler(
         MessageHandler(filters.TEXT & (~filters.COMMAND), collect_data)
     )
 
+    application.job_queue.run_repeating(
+        expire_trials,
+        interval=int(os.getenv("TRIAL_SWEEP_INTERVAL", "300")),
+        first=0,
+    )
+    application.job_queue.run_repeating(
+        flush_digests, interval=digest_interval(), first=digest_interval()
+    )
+
     # Log all errors
     application.add_error_handler(error)
 
+    return application
+
+
+def main(mode: str = None) -> None:
+    bot_token = os.getenv("BOT_TOKEN")
+    if not bot_token:
+        logger.error("BOT_TOKEN is not set in the environment variables.")
+        raise ValueError("BOT_TOKEN is not set in the environment variables.")
+
+    application = build_application(
+        bot_token, journal_path=os.getenv("UPDATE_JOURNAL")
+    )
+
     # Start the Bot
-    application.run_polling()
+    mode = mode or os.getenv("BOT_MODE", "polling")
+    if mode == "webhook":
+        run_webhook(application)
+    else:
+        application.run_polling()
 
 
 if __name__ == "__main__":
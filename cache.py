@@ -0,0 +1,90 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+# Fields the handlers need from a user document
+USER_FIELDS = {
+    "_id": 0,
+    "user_id": 1,
+    "status": 1,
+    "services": 1,
+    "trial_end_date": 1,
+    "digest": 1,
+}
+
+
+class UserCache:
+    """Bounded LRU cache of user documents with a time-to-live.
+
+    Reads fall through to the users collection on a miss; handlers that write
+    a user either ``put`` the updated document or ``invalidate`` it.
+    """
+
+    def __init__(self, collection, maxsize: int = 10000, ttl: float = 300.0) -> None:
+        self.collection = collection
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, user_id: int) -> Optional[dict]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return user
+
+    def put(self, user: dict) -> None:
+        user = {field: user[field] for field in USER_FIELDS if field in user}
+        self._entries[user["user_id"]] = (time.monotonic() + self.ttl, user)
+        self._entries.move_to_end(user["user_id"])
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._entries.pop(user_id, None)
+
+    async def get(self, user_id: int) -> Optional[dict]:
+        user = self._lookup(user_id)
+        if user is not None:
+            self.hits += 1
+            return user
+        self.misses += 1
+        user = await self.collection.find_one({"user_id": user_id}, USER_FIELDS)
+        if user is not None:
+            self.put(user)
+        return user
+
+    async def get_many(self, user_ids: Iterable[int]) -> Dict[int, dict]:
+        # Cached users plus one $in query for all the misses
+        users = {}
+        missing = []
+        for user_id in user_ids:
+            user = self._lookup(user_id)
+            if user is not None:
+                users[user_id] = user
+            else:
+                missing.append(user_id)
+        self.hits += len(users)
+        self.misses += len(missing)
+        if missing:
+            async for user in self.collection.find(
+                {"user_id": {"$in": missing}}, USER_FIELDS
+            ):
+                self.put(user)
+                users[user["user_id"]] = user
+        return users
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
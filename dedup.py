@@ -0,0 +1,100 @@
+import hashlib
+import re
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from normalize import words
+
+_URL = re.compile(r"https?://\S+|t\.me/\S+|@\w+", re.IGNORECASE)
+
+
+def tokenize(text: str) -> List[str]:
+    # Links and mentions differ between cross-posts, so they don't count; the
+    # rest is normalized like keyword matching, so homoglyph or zero-width
+    # variants of a post get the same fingerprint
+    return words(_URL.sub(" ", text))
+
+
+def simhash(tokens: List[str], bits: int = 64) -> int:
+    weights = [0] * bits
+    # Single words plus adjacent pairs, so word order still matters a little
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    for feature in features:
+        digest = int.from_bytes(
+            hashlib.blake2b(feature.encode(), digest_size=bits // 8).digest(), "big"
+        )
+        for bit in range(bits):
+            weights[bit] += 1 if digest >> bit & 1 else -1
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+class NearDuplicateIndex:
+    """SimHash index of recently seen messages over a sliding time window.
+
+    Fingerprints are split into ``max_distance + 1`` bands; two fingerprints
+    within ``max_distance`` bits of each other share at least one band, so
+    only messages in a matching band bucket are compared.
+    """
+
+    def __init__(
+        self, window: float = 6 * 60 * 60, max_distance: int = 6, min_tokens: int = 8
+    ) -> None:
+        self.window = window
+        self.max_distance = max_distance
+        # Short texts give unstable fingerprints; only exact matches count there
+        self.min_tokens = min_tokens
+        band_count = max_distance + 1
+        width = 64 // band_count
+        self._bands = [
+            (index * width, 64 - index * width if index == band_count - 1 else width)
+            for index in range(band_count)
+        ]
+        self._buckets: List[Dict[int, list]] = [{} for _ in self._bands]
+        self._entries = deque()  # (seen_at, fingerprint, key) in insertion order
+        self.duplicates = 0
+
+    def _band_values(self, fingerprint: int):
+        for index, (shift, width) in enumerate(self._bands):
+            yield index, fingerprint >> shift & ((1 << width) - 1)
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.window
+        while self._entries and self._entries[0][0] < cutoff:
+            entry = self._entries.popleft()
+            for index, value in self._band_values(entry[1]):
+                bucket = self._buckets[index].get(value)
+                if bucket is not None:
+                    bucket.remove(entry)
+                    if not bucket:
+                        del self._buckets[index][value]
+
+    def fingerprint(self, text: str) -> Tuple[int, int]:
+        tokens = tokenize(text)
+        return simhash(tokens), len(tokens)
+
+    def find(self, fingerprint: int, token_count: int, now: float = None) -> Optional[Any]:
+        # Key of a recent message within the allowed distance, if any
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+        max_distance = self.max_distance if token_count >= self.min_tokens else 0
+        for index, value in self._band_values(fingerprint):
+            for _, other, key in self._buckets[index].get(value, ()):
+                if bin(fingerprint ^ other).count("1") <= max_distance:
+                    self.duplicates += 1
+                    return key
+        return None
+
+    def add(self, fingerprint: int, key: Any, now: float = None) -> None:
+        now = time.monotonic() if now is None else now
+        entry = (now, fingerprint, key)
+        self._entries.append(entry)
+        for index, value in self._band_values(fingerprint):
+            self._buckets[index].setdefault(value, []).append(entry)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,119 @@
+import asyncio
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+
+# Telegram rejects messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+
+
+class DigestBuffer:
+    """Per-user buffer of matched ads waiting to be sent as one digest message.
+
+    Items are stored in ``collection`` so a restart or crash doesn't lose
+    them. Buffers are flushed by a periodic job, or as soon as a user has
+    ``max_items`` pending; items are removed only after their digest is in
+    the outbox, so a crash in between can repeat an item but never drop it.
+    """
+
+    def __init__(
+        self, collection, max_items: int = 20, excerpt_length: int = 300
+    ) -> None:
+        self.collection = collection
+        self.max_items = max_items
+        self.excerpt_length = excerpt_length
+        # Held while a flush reads and removes items, so none goes out twice
+        self.lock = asyncio.Lock()
+        self._counts: Dict[int, int] = {}
+
+    async def load(self) -> int:
+        # Pending counts of items left over from the previous run
+        self._counts = {}
+        async for item in self.collection.find({}, {"user_id": 1}):
+            self._counts[item["user_id"]] = self._counts.get(item["user_id"], 0) + 1
+        return len(self)
+
+    async def add(self, user_ids: List[int], data: dict) -> List[int]:
+        # Returns the users whose buffer is now full and should be flushed
+        if not user_ids:
+            return []
+        now = datetime.utcnow()
+        items = [
+            {
+                "user_id": user_id,
+                "chat_id": data["chat_id"],
+                "message_id": data["message_id"],
+                "text": data.get("text", ""),
+                "message_link": data.get("message_link"),
+                "created_at": now,
+            }
+            for user_id in user_ids
+        ]
+        added = user_ids
+        try:
+            await self.collection.insert_many(items, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            # Duplicate key: the message is already buffered for that user
+            if any(error.get("code") != 11000 for error in errors):
+                raise
+            skipped = {items[error["index"]]["user_id"] for error in errors}
+            added = [user_id for user_id in user_ids if user_id not in skipped]
+
+        full = []
+        for user_id in added:
+            self._counts[user_id] = self._counts.get(user_id, 0) + 1
+            if self._counts[user_id] >= self.max_items:
+                full.append(user_id)
+        return full
+
+    async def pending(self, user_id: Optional[int] = None) -> Dict[int, List[dict]]:
+        # Buffered items per user, oldest first; all users unless one is given
+        query = {} if user_id is None else {"user_id": user_id}
+        grouped: Dict[int, List[dict]] = {}
+        async for item in self.collection.find(query).sort("_id", 1):
+            grouped.setdefault(item["user_id"], []).append(item)
+        return grouped
+
+    async def remove(self, items: List[dict]) -> None:
+        if not items:
+            return
+        await self.collection.delete_many(
+            {"_id": {"$in": [item["_id"] for item in items]}}
+        )
+        for item in items:
+            count = self._counts.get(item["user_id"], 0) - 1
+            if count > 0:
+                self._counts[item["user_id"]] = count
+            else:
+                self._counts.pop(item["user_id"], None)
+
+    def __len__(self) -> int:
+        return sum(self._counts.values())
+
+    def _format_item(self, number: int, item: dict) -> str:
+        text = item["text"]
+        if len(text) > self.excerpt_length:
+            text = text[: self.excerpt_length].rstrip() + "…"
+        lines = [f"{number}. {text}"]
+        if item.get("message_link"):
+            lines.append(item["message_link"])
+        return "\n".join(lines)
+
+    def render(self, items: List[dict]) -> List[Tuple[str, List[dict]]]:
+        # Splits the digest into messages that fit Telegram's length limit;
+        # each message comes with the items it covers
+        messages = []
+        header = f"{len(items)} new matching posts:"
+        text, covered = header, []
+        for number, item in enumerate(items, start=1):
+            block = self._format_item(number, item)
+            if covered and len(text) + 2 + len(block) > MAX_MESSAGE_LENGTH:
+                messages.append((text, covered))
+                text, covered = "", []
+            text = f"{text}\n\n{block}" if text else block
+            covered.append(item)
+        if covered:
+            messages.append((text[:MAX_MESSAGE_LENGTH], covered))
+        return messages
@@ -0,0 +1,491 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+def make_notification(
+    user_id: int,
+    chat_id: int,
+    message_id: int,
+    text: str,
+    buttons: Iterable[tuple] = (),
+) -> dict:
+    # Buttons are stored as (text, url) pairs so the entry can live in Mongo.
+    # Message ids are only unique within a chat, hence (chat_id, message_id).
+    return {
+        "user_id": user_id,
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "text": text,
+        "buttons": [{"text": label, "url": url} for label, url in buttons],
+    }
+
+
+def make_digest_notification(user_id: int, text: str, items: List[dict]) -> dict:
+    # One message covering several ads; each is recorded as delivered
+    return {
+        "user_id": user_id,
+        "text": text,
+        "buttons": [],
+        "items": [
+            {"chat_id": item["chat_id"], "message_id": item["message_id"]}
+            for item in items
+        ],
+    }
+
+
+def _deliveries(entry: dict) -> List[dict]:
+    if entry.get("items"):
+        return entry["items"]
+    return [{"chat_id": entry.get("chat_id"), "message_id": entry["message_id"]}]
+
+
+def _reply_markup(entry: dict) -> Optional[InlineKeyboardMarkup]:
+    buttons = [
+        InlineKeyboardButton(text=button["text"], url=button["url"])
+        for button in entry.get("buttons", [])
+    ]
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+def _seconds(value) -> float:
+    # RetryAfter.retry_after is a number of seconds (or a timedelta)
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class Outbox:
+    """Mongo-backed queue of pending notifications.
+
+    Entries are claimed with a lease before sending and deleted once delivered,
+    so anything left behind by a crash or restart is picked up again once its
+    lease expires.
+    """
+
+    def __init__(
+        self, collection, lease_seconds: int = 60, max_attempts: int = 5
+    ) -> None:
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def add(self, notifications: List[dict]) -> list:
+        if not notifications:
+            return []
+        now = datetime.utcnow()
+        entries = [
+            {
+                **notification,
+                "state": "pending",
+                "created_at": now,
+                "lease_until": None,
+                "owner": None,
+                "claims": 0,
+                "attempts": 0,
+            }
+            for notification in notifications
+        ]
+        result = await self.collection.insert_many(entries, ordered=False)
+        return result.inserted_ids
+
+    async def claim(self, entry_id) -> Optional[dict]:
+        # Atomically take the lease unless another worker currently holds it
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {
+                "_id": entry_id,
+                "state": "pending",
+                "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}],
+            },
+            {
+                "$set": {
+                    "lease_until": now + timedelta(seconds=self.lease_seconds),
+                    "owner": self.owner,
+                },
+                "$inc": {"claims": 1},
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def claimable(self, limit: int) -> list:
+        # Ids of pending entries that nobody holds a valid lease on
+        cursor = self.collection.find(
+            {
+                "state": "pending",
+                "$or": [
+                    {"lease_until": None},
+                    {"lease_until": {"$lt": datetime.utcnow()}},
+                ],
+            },
+            {"_id": 1},
+        ).limit(limit)
+        return [entry["_id"] async for entry in cursor]
+
+    async def renew(self, entry: dict) -> None:
+        # Extend our lease while a send is backing off
+        await self.collection.update_one(
+            {"_id": entry["_id"], "owner": self.owner},
+            {
+                "$set": {
+                    "lease_until": datetime.utcnow()
+                    + timedelta(seconds=self.lease_seconds)
+                }
+            },
+        )
+
+    async def complete(self, entry: dict) -> None:
+        await self.collection.delete_one({"_id": entry["_id"]})
+
+    async def release(self, entry: dict, error: str, retry: bool = True) -> None:
+        # Give the entry back for a retry, or park it after too many attempts
+        attempts = entry.get("attempts", 0) + 1
+        if not retry or attempts >= self.max_attempts:
+            state = "failed"
+        else:
+            state = "pending"
+        await self.collection.update_one(
+            {"_id": entry["_id"]},
+            {
+                "$set": {
+                    "state": state,
+                    "attempts": attempts,
+                    "lease_until": None,
+                    "owner": None,
+                    "last_error": error,
+                }
+            },
+        )
+
+
+class NotificationDispatcher:
+    """Pool of asyncio workers delivering entries from the outbox.
+
+    New entries are pushed onto an in-memory queue right away if it has room;
+    a recovery loop queues the rest, and entries whose lease expired (e.g.
+    after a restart). Rate limits
+    are enforced by the bot's rate limiter (see ``main``); when Telegram still
+    answers with RetryAfter, every worker pauses for the requested time.
+    Network errors are retried with exponential backoff, and users that
+    blocked the bot are reported in batches to ``on_unreachable``.
+    """
+
+    def __init__(
+        self,
+        outbox: Outbox,
+        delivered_collection,
+        workers: int = 8,
+        max_queue: int = 10000,
+        max_network_retries: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 30.0,
+        max_retry_after: int = 10,
+        backlog_interval: float = 1.0,
+    ) -> None:
+        self.outbox = outbox
+        self.delivered_collection = delivered_collection
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._queued_ids: Set = set()
+        # Entries that didn't fit in the queue are left to the recovery loop,
+        # which rescans every `backlog_interval` seconds while any are waiting
+        self._backlog = asyncio.Event()
+        self.backlog_interval = backlog_interval
+        self._tasks: List[asyncio.Task] = []
+        self._bot: Optional[Bot] = None
+        self._recent = deque()  # Timestamps of sends in the last minute
+        self.max_network_retries = max_network_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        # Cleared while Telegram asks us to back off (RetryAfter)
+        self._resume = asyncio.Event()
+        self._resume.set()
+        self._paused_until = 0.0
+        self._unreachable: Set[int] = set()
+        self._unreachable_pending: Set[int] = set()
+        self._on_unreachable: Optional[Callable[[List[int]], Awaitable[None]]] = None
+        self.enqueued = 0
+        self.sent = 0
+        self.failed = 0
+        self.recovered = 0
+        self.skipped_unreachable = 0
+        self.errors: Dict[str, int] = {}
+        self.started_at = None
+
+    async def start(
+        self,
+        bot: Bot,
+        on_unreachable: Optional[Callable[[List[int]], Awaitable[None]]] = None,
+    ) -> None:
+        self._bot = bot
+        self._on_unreachable = on_unreachable
+        self.started_at = time.monotonic()
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"notify-worker-{i}")
+            for i in range(self.workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._recover(), name="notify-recover"))
+        self._tasks.append(
+            asyncio.create_task(self._report_unreachable(), name="notify-unreachable")
+        )
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        # Anything not delivered in time stays in the outbox for the next run
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Stopping with notifications left in the outbox "
+                f"({self.queue_depth} queued)."
+            )
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._flush_unreachable()
+
+    async def _drain(self) -> None:
+        # Entries that overflowed the queue are still pending in the outbox
+        while True:
+            await self._queue.join()
+            if not await self.outbox.claimable(1):
+                return
+            self._backlog.set()
+            await asyncio.sleep(0.1)
+
+    def mark_reachable(self, user_id: int) -> None:
+        # The user came back (e.g. sent /start after unblocking the bot)
+        self._unreachable.discard(user_id)
+        self._unreachable_pending.discard(user_id)
+
+    def _mark_unreachable(self, user_id: int) -> None:
+        if user_id not in self._unreachable:
+            self._unreachable.add(user_id)
+            self._unreachable_pending.add(user_id)
+
+    async def _flush_unreachable(self) -> None:
+        if not self._unreachable_pending or self._on_unreachable is None:
+            return
+        user_ids, self._unreachable_pending = list(self._unreachable_pending), set()
+        try:
+            await self._on_unreachable(user_ids)
+        except Exception as e:
+            logger.error(f"Error deactivating {len(user_ids)} unreachable users: {e}")
+
+    async def _report_unreachable(self, interval: float = 5.0) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self._flush_unreachable()
+
+    def _pause(self, seconds: float) -> None:
+        until = time.monotonic() + seconds
+        if until <= self._paused_until:
+            return
+        self._paused_until = until
+        self._resume.clear()
+        asyncio.get_running_loop().call_later(seconds, self._maybe_resume)
+
+    def _maybe_resume(self) -> None:
+        # A later, longer pause may have replaced the one this call was for
+        if time.monotonic() >= self._paused_until - 0.05:
+            self._resume.set()
+
+    def _count_error(self, error: Exception) -> None:
+        name = type(error).__name__
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    async def submit(self, notifications: List[dict]) -> None:
+        # Persist first, then wake the workers. Never waits on a full queue:
+        # the overflow is already in the outbox and the recovery loop picks it up
+        entry_ids = await self.outbox.add(notifications)
+        for entry_id in entry_ids:
+            if not self._put(entry_id):
+                self._backlog.set()
+                break
+        self.enqueued += len(entry_ids)
+
+    def _put(self, entry_id) -> bool:
+        try:
+            self._queue.put_nowait(entry_id)
+        except asyncio.QueueFull:
+            return False
+        self._queued_ids.add(entry_id)
+        return True
+
+    async def _recover(self) -> None:
+        while True:
+            # Set by submit() from here on if the queue fills up again
+            self._backlog.clear()
+            backlog = False
+            try:
+                free = self.max_queue - self._queue.qsize()
+                claimable = await self.outbox.claimable(free) if free > 0 else []
+                # A full queue or a full page means more entries are waiting
+                backlog = free <= 0 or len(claimable) >= free
+                for entry_id in claimable:
+                    if entry_id not in self._queued_ids:
+                        if not self._put(entry_id):
+                            backlog = True
+                            break
+                        self.recovered += 1
+            except Exception as e:
+                logger.error(f"Error recovering notifications from the outbox: {e}")
+            if not backlog:
+                try:
+                    await asyncio.wait_for(
+                        self._backlog.wait(), self.outbox.lease_seconds
+                    )
+                except asyncio.TimeoutError:
+                    continue
+            await asyncio.sleep(self.backlog_interval)
+
+    async def _worker(self) -> None:
+        while True:
+            entry_id = await self._queue.get()
+            try:
+                entry = await self.outbox.claim(entry_id)
+                if entry is not None:
+                    await self._send(entry)
+            except Exception as e:
+                logger.error(f"Error processing outbox entry {entry_id}: {e}")
+            finally:
+                self._queued_ids.discard(entry_id)
+                self._queue.task_done()
+
+    async def _already_delivered(self, entry: dict) -> bool:
+        # Deliveries of one entry are recorded together, so checking one is enough
+        delivery = _deliveries(entry)[0]
+        return (
+            await self.delivered_collection.find_one(
+                {"user_id": entry["user_id"], **delivery}
+            )
+            is not None
+        )
+
+    async def _send(self, entry: dict) -> None:
+        user_id = entry["user_id"]
+        # A previous claim may have sent the message before the process died
+        if entry.get("claims", 1) > 1 and await self._already_delivered(entry):
+            await self.outbox.complete(entry)
+            return
+
+        if user_id in self._unreachable:
+            self.skipped_unreachable += 1
+            await self.outbox.complete(entry)
+            return
+
+        network_failures = 0
+        retry_afters = 0
+        while True:
+            await self._resume.wait()
+            try:
+                await self._bot.send_message(
+                    chat_id=user_id,
+                    text=entry["text"],
+                    reply_markup=_reply_markup(entry),
+                )
+                break
+            except RetryAfter as e:
+                self._count_error(e)
+                retry_afters += 1
+                if retry_afters > self.max_retry_after:
+                    await self._give_up(entry, e)
+                    return
+                self._pause(_seconds(e.retry_after))
+                logger.warning(f"Flood control, pausing sends for {e.retry_after}s.")
+            except Forbidden as e:
+                # Blocked by the user or the account was deleted
+                self._count_error(e)
+                self._mark_unreachable(user_id)
+                await self.outbox.complete(entry)
+                return
+            except BadRequest as e:
+                self._count_error(e)
+                if "chat not found" in e.message.lower():
+                    self._mark_unreachable(user_id)
+                    await self.outbox.complete(entry)
+                else:
+                    # Retrying the same request won't help
+                    await self._give_up(entry, e, retry=False)
+                return
+            except NetworkError as e:
+                self._count_error(e)
+                network_failures += 1
+                if network_failures > self.max_network_retries:
+                    await self._give_up(entry, e)
+                    return
+                await asyncio.sleep(
+                    min(self.backoff_base * 2 ** (network_failures - 1), self.backoff_max)
+                )
+            except Exception as e:
+                self._count_error(e)
+                await self._give_up(entry, e)
+                return
+            await self.outbox.renew(entry)
+
+        self.sent += 1
+        self._recent.append(time.monotonic())
+        self._trim_recent()
+        logger.info(f"Notification sent to user {user_id}.")
+        now = datetime.utcnow()
+        try:
+            await self.delivered_collection.insert_many(
+                [
+                    {"user_id": user_id, **delivery, "created_at": now}
+                    for delivery in _deliveries(entry)
+                ],
+                ordered=False,
+            )
+        except BulkWriteError as e:
+            # Duplicates were already recorded by an earlier delivery
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errors):
+                logger.error(f"Error recording notification for user {user_id}: {errors}")
+        await self.outbox.complete(entry)
+
+    async def _give_up(self, entry: dict, error: Exception, retry: bool = True) -> None:
+        self.failed += 1
+        logger.error(f"Error sending notification to user {entry['user_id']}: {error}")
+        await self.outbox.release(entry, str(error), retry=retry)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def _trim_recent(self, window: float = 60.0) -> None:
+        cutoff = time.monotonic() - window
+        while self._recent and self._recent[0] < cutoff:
+            self._recent.popleft()
+
+    def throughput(self) -> float:
+        # Messages per second over the last minute
+        self._trim_recent()
+        return len(self._recent) / 60.0
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "enqueued": self.enqueued,
+            "recovered": self.recovered,
+            "sent": self.sent,
+            "failed": self.failed,
+            "skipped_unreachable": self.skipped_unreachable,
+            "errors": dict(self.errors),
+            "paused": not self._resume.is_set(),
+            "per_second": round(self.throughput(), 2),
+        }
@@ -0,0 +1,46 @@
+import json
+import logging
+import time
+from typing import Iterator, Optional
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateJournal:
+    """Append-only JSONL log of incoming updates, for replaying them later.
+
+    Each line holds the receive time and the update as Telegram sent it.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+        self.recorded = 0
+
+    async def record(self, update: Update, _: CallbackContext) -> None:
+        try:
+            line = json.dumps(
+                {"received_at": time.time(), "update": update.to_dict()},
+                ensure_ascii=False,
+                default=str,
+            )
+            self._file.write(line + "\n")
+            self.recorded += 1
+        except Exception as e:
+            logger.error(f"Error journaling update {update.update_id}: {e}")
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def read_journal(path: str, limit: Optional[int] = None) -> Iterator[dict]:
+    with open(path, encoding="utf-8") as journal:
+        for count, line in enumerate(journal):
+            if limit is not None and count >= limit:
+                return
+            line = line.strip()
+            if line:
+                yield json.loads(line)
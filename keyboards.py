@@ -0,0 +1,112 @@
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+CALLBACK_VERSION = "1"
+
+# One-character action codes used in callback_data
+ACTION_CODES = {
+    "on": "n",
+    "off": "f",
+    "page": "p",
+}
+_ACTIONS_BY_CODE = {code: action for action, code in ACTION_CODES.items()}
+# Actions whose argument is a service rather than a plain number
+SERVICE_ACTIONS = {"on", "off"}
+_BASE36_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+class CallbackCodec:
+    """Compact, versioned callback_data encoding.
+
+    Payloads look like ``"1n5"``: version, action code, then the argument in
+    base 36. Services are referred to by their position in ``services``, so new
+    services must be appended to the end of the list. Legacy ``"<service>_on"``
+    payloads from keyboards sent before versioning are still understood.
+    """
+
+    def __init__(self, services: List[str]) -> None:
+        self.services = list(services)
+        self._ids: Dict[str, int] = {
+            service: index for index, service in enumerate(self.services)
+        }
+
+    def encode(self, action: str, argument: Union[str, int]) -> str:
+        if action in SERVICE_ACTIONS:
+            argument = self._ids[argument]
+        return f"{CALLBACK_VERSION}{ACTION_CODES[action]}{_base36(argument)}"
+
+    def decode(self, data: str) -> Optional[Tuple[str, Union[str, int]]]:
+        # Returns (action, argument), or None for payloads we can't read
+        if not data:
+            return None
+        if data[0] == CALLBACK_VERSION and len(data) > 2:
+            action = _ACTIONS_BY_CODE.get(data[1])
+            # int() alone would also take signs, spaces, underscores and capitals
+            if action is None or data[2:].strip(_BASE36_DIGITS):
+                return None
+            argument = int(data[2:], 36)
+            if action in SERVICE_ACTIONS:
+                if argument >= len(self.services):
+                    return None
+                return action, self.services[argument]
+            return action, argument
+        return self._decode_legacy(data)
+
+    def _decode_legacy(self, data: str) -> Optional[Tuple[str, str]]:
+        service, _, action = data.rpartition("_")
+        if action in SERVICE_ACTIONS and service in self._ids:
+            return action, service
+        return None
+
+
+def _base36(number: int) -> str:
+    if number == 0:
+        return "0"
+    encoded = ""
+    while number:
+        number, remainder = divmod(number, 36)
+        encoded = _BASE36_DIGITS[remainder] + encoded
+    return encoded
+
+
+class ServiceKeyboard:
+    """Renders the service selection keyboard, memoized per selection.
+
+    A selection is reduced to a bitmask over ``services`` and the built
+    ``InlineKeyboardMarkup`` objects are kept in an LRU cache keyed by it.
+    """
+
+    def __init__(
+        self, services: List[str], codec: CallbackCodec, maxsize: int = 512
+    ) -> None:
+        self.services = list(services)
+        self.codec = codec
+        self._bits: Dict[str, int] = {
+            service: 1 << index for index, service in enumerate(self.services)
+        }
+        self._render_mask = lru_cache(maxsize=maxsize)(self._build)
+
+    def mask(self, selected_services: Iterable[str]) -> int:
+        mask = 0
+        for service in selected_services:
+            mask |= self._bits.get(service, 0)
+        return mask
+
+    def render(self, selected_services: Iterable[str]) -> InlineKeyboardMarkup:
+        return self._render_mask(self.mask(selected_services))
+
+    def _build(self, mask: int) -> InlineKeyboardMarkup:
+        keyboard = []
+        for index, service in enumerate(self.services):
+            is_on = bool(mask >> index & 1)
+            color = "🟢" if is_on else "🔴"
+            button_text = f"{color} {service}"
+            callback_data = self.codec.encode("off" if is_on else "on", service)
+            button = InlineKeyboardButton(button_text, callback_data=callback_data)
+            keyboard.append([button])
+        return InlineKeyboardMarkup(keyboard)
+
+    def cache_info(self):
+        return self._render_mask.cache_info()
@@ -0,0 +1,169 @@
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Union
+
+from normalize import words
+
+# Either one keyword list, or keyword lists per language ({"en": [...], ...})
+Keywords = Union[Iterable[str], Dict[str, Iterable[str]]]
+
+
+def flatten_keywords(keywords: Keywords) -> List[str]:
+    if isinstance(keywords, dict):
+        return [keyword for language in keywords.values() for keyword in language]
+    return list(keywords)
+
+
+def check_transliterations(service_keywords: Dict[str, Keywords]) -> None:
+    """Reject non-English keywords that normalize to English words.
+
+    Transliteration turns e.g. "трансфер" into "transfer", which would then
+    match every English message using that word. Repeating a keyword that the
+    service already has in English ("хостел" for "hostel") is allowed.
+    """
+    english = {
+        service: set(
+            " ".join(words(keyword))
+            for keyword in (
+                keywords.get("en", ()) if isinstance(keywords, dict) else keywords
+            )
+        )
+        for service, keywords in service_keywords.items()
+    }
+    english_phrases = set().union(*english.values())
+    english_words = {word for phrase in english_phrases for word in phrase.split()}
+    for service, keywords in service_keywords.items():
+        if not isinstance(keywords, dict):
+            continue
+        for language, phrases in keywords.items():
+            if language == "en":
+                continue
+            for keyword in phrases:
+                normalized = " ".join(words(keyword))
+                if normalized in english[service]:
+                    continue
+                if normalized in english_phrases or normalized in english_words:
+                    raise ValueError(
+                        f"{language} keyword {keyword!r} of {service!r} normalizes "
+                        f"to the English {normalized!r}; use a more specific phrase."
+                    )
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over words, mapping phrases back to their services.
+
+    Keywords are split into words, so a keyword only matches whole words that
+    appear next to each other in the message ("rent" does not match "parent").
+    Keywords and messages both go through ``normalize``, so keywords in any
+    language or script share one automaton.
+    The automaton is compiled once from a ``{service: [keyword, ...]}`` mapping
+    and finds every matched service in a single pass over the message's words.
+
+    ``exclusions`` maps services to phrases that cancel a keyword match lying
+    entirely inside them, e.g. "visa card" for the keyword "visa".
+    """
+
+    def __init__(
+        self,
+        service_keywords: Dict[str, Keywords],
+        exclusions: Optional[Dict[str, Keywords]] = None,
+    ) -> None:
+        self._signature = None
+        self.update(service_keywords, exclusions)
+
+    @staticmethod
+    def _make_signature(
+        service_keywords: Dict[str, Keywords],
+        exclusions: Optional[Dict[str, Keywords]],
+    ) -> tuple:
+        exclusions = exclusions or {}
+        return tuple(
+            (
+                service,
+                tuple(flatten_keywords(keywords)),
+                tuple(flatten_keywords(exclusions.get(service, ()))),
+            )
+            for service, keywords in service_keywords.items()
+        )
+
+    def update(
+        self,
+        service_keywords: Dict[str, Keywords],
+        exclusions: Optional[Dict[str, Keywords]] = None,
+    ) -> bool:
+        # Only recompile when the keyword set actually changed
+        signature = self._make_signature(service_keywords, exclusions)
+        if signature == self._signature:
+            return False
+        check_transliterations(service_keywords)
+        self._signature = signature
+        self._compile(signature)
+        return True
+
+    def _compile(self, signature: tuple) -> None:
+        self.services: List[str] = [service for service, _, _ in signature]
+        goto: List[Dict[str, int]] = [{}]
+        # Per state: (service index, phrase length in words, is an exclusion)
+        outputs: List[set] = [set()]
+
+        def add_phrase(phrase: str, index: int, is_exclusion: bool) -> None:
+            phrase_words = words(phrase)
+            state = 0
+            for word in phrase_words:
+                next_state = goto[state].get(word)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][word] = next_state
+                    goto.append({})
+                    outputs.append(set())
+                state = next_state
+            if phrase_words:
+                outputs[state].add((index, len(phrase_words), is_exclusion))
+
+        for index, (_, keywords, excluded) in enumerate(signature):
+            for keyword in keywords:
+                add_phrase(keyword, index, False)
+            for phrase in excluded:
+                add_phrase(phrase, index, True)
+
+        # Breadth-first pass to compute failure links and merge outputs
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and word not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(word, 0)
+                outputs[next_state] |= outputs[fail[next_state]]
+
+        self._goto = goto
+        self._fail = fail
+        self._outputs = [tuple(sorted(output)) for output in outputs]
+
+    def match(self, text: str) -> List[str]:
+        # Returns matched services in the order they were declared
+        goto = self._goto
+        fail = self._fail
+        outputs = self._outputs
+        found = []  # (service index, first word, last word)
+        excluded = []
+        state = 0
+        for position, word in enumerate(words(text)):
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            for index, length, is_exclusion in outputs[state]:
+                span = (index, position - length + 1, position)
+                (excluded if is_exclusion else found).append(span)
+        if excluded:
+            found = [
+                (index, start, end)
+                for index, start, end in found
+                if not any(
+                    index == other and first <= start and end <= last
+                    for other, first, last in excluded
+                )
+            ]
+        return [self.services[index] for index in sorted({span[0] for span in found})]
@@ -0,0 +1,72 @@
+import re
+import unicodedata
+from typing import List
+
+# Letters and digits only: punctuation, emoji and underscores separate words
+_WORD = re.compile(r"[^\W_]+")
+_LATIN = re.compile(r"[a-z]")
+
+# Zero-width characters used to break up words without changing how they look
+_INVISIBLE = dict.fromkeys(map(ord, "\u00ad\u200b\u200c\u200d\u2060\ufeff"))
+
+# Cyrillic and Greek letters that look like Latin ones (after casefolding)
+_HOMOGLYPHS = {
+    "а": "a", "е": "e", "ё": "e", "к": "k", "о": "o", "р": "p", "с": "c",
+    "у": "y", "х": "x", "і": "i", "ј": "j", "ѕ": "s", "һ": "h", "ԁ": "d",
+    "ӏ": "l", "α": "a", "ε": "e", "ι": "i", "κ": "k", "ν": "v", "ο": "o",
+    "ρ": "p", "υ": "u", "χ": "x",
+}
+_TO_LATIN = str.maketrans(_HOMOGLYPHS)
+# Latin letters slipped into otherwise Cyrillic words
+_TO_CYRILLIC = str.maketrans(
+    {"a": "а", "e": "е", "k": "к", "o": "о", "p": "р", "c": "с", "y": "у", "x": "х"}
+)
+
+_CYRILLIC = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e",
+    "ж": "zh", "з": "z", "и": "i", "й": "i", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "h", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sch", "ъ": "",
+    "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+    "є": "e", "і": "i", "ї": "i", "ґ": "g",
+}
+# National system of romanization for Georgian
+_GEORGIAN = {
+    "ა": "a", "ბ": "b", "გ": "g", "დ": "d", "ე": "e", "ვ": "v", "ზ": "z",
+    "თ": "t", "ი": "i", "კ": "k", "ლ": "l", "მ": "m", "ნ": "n", "ო": "o",
+    "პ": "p", "ჟ": "zh", "რ": "r", "ს": "s", "ტ": "t", "უ": "u", "ფ": "p",
+    "ქ": "k", "ღ": "gh", "ყ": "q", "შ": "sh", "ჩ": "ch", "ც": "ts", "ძ": "dz",
+    "წ": "ts", "ჭ": "ch", "ხ": "kh", "ჯ": "j", "ჰ": "h",
+}
+_TRANSLITERATE = str.maketrans({**_CYRILLIC, **_GEORGIAN})
+
+
+def _fold_word(match: re.Match) -> str:
+    word = match.group()
+    if word.isascii() or not _LATIN.search(word):
+        return word
+    # A Cyrillic letter with no Latin look-alike means the word is Russian
+    if any(
+        "\u0400" <= char <= "\u04ff" and char not in _HOMOGLYPHS for char in word
+    ):
+        return word.translate(_TO_CYRILLIC)
+    return word.translate(_TO_LATIN)
+
+
+def normalize(text: str) -> str:
+    """Fold text to the lowercase Latin form keywords are matched in.
+
+    Applies NFKC and casefolding, drops zero-width characters, folds
+    look-alike letters in mixed-script words ("rеnt" with a Cyrillic "е")
+    and transliterates Cyrillic and Georgian to Latin.
+    """
+    # Most messages are plain ASCII and need nothing beyond lowercasing
+    if text.isascii():
+        return text.lower()
+    text = unicodedata.normalize("NFKC", text).casefold().translate(_INVISIBLE)
+    text = _WORD.sub(_fold_word, text)
+    return text.translate(_TRANSLITERATE)
+
+
+def words(text: str) -> List[str]:
+    return _WORD.findall(normalize(text))
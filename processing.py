@@ -0,0 +1,57 @@
+import asyncio
+from typing import Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserCallbackProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently, but one callback query per user at a time.
+
+    Group messages are handled fully in parallel (up to the concurrency limit),
+    while a user's button presses are serialized so their read-modify-write of
+    the selected services can't interleave.
+    """
+
+    def __init__(self, max_concurrent_updates: int) -> None:
+        super().__init__(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiters: Dict[int, int] = {}
+
+    @staticmethod
+    def _callback_user_id(update: object) -> Optional[int]:
+        if isinstance(update, Update) and update.callback_query is not None:
+            return update.callback_query.from_user.id
+        return None
+
+    # process_update is marked final, but it takes the concurrency semaphore
+    # before do_process_update runs; queued button presses must wait on their
+    # user's lock first, or one user tapping quickly fills every slot
+    async def process_update(  # type: ignore[misc]
+        self, update: object, coroutine: Awaitable
+    ) -> None:
+        user_id = self._callback_user_id(update)
+        if user_id is None:
+            await super().process_update(update, coroutine)
+            return
+
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        self._waiters[user_id] = self._waiters.get(user_id, 0) + 1
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            # Drop the lock once nobody is queued on it anymore
+            self._waiters[user_id] -= 1
+            if not self._waiters[user_id]:
+                del self._waiters[user_id]
+                del self._locks[user_id]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
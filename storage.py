@@ -0,0 +1,268 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter:
+    """Write-behind buffer that groups inserts into ``insert_many`` calls.
+
+    Documents are flushed once ``max_batch`` of them are buffered or every
+    ``flush_interval`` seconds, whichever comes first. Updates queued with
+    ``update`` are applied after the inserts of the same flush, and flushes
+    never overlap, so an update can target a document that is still buffered.
+    """
+
+    def __init__(
+        self, collection, max_batch: int = 100, flush_interval: float = 1.0
+    ) -> None:
+        self.collection = collection
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._buffer: List[dict] = []
+        self._updates: List[UpdateOne] = []
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self._flushes = set()
+        self.written = 0
+        self.failed = 0
+
+    async def start(self) -> None:
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run(), name="batch-writer")
+
+    async def stop(self) -> None:
+        # Let a running flush finish: cancelling it would drop the batch it took
+        if self._task is not None:
+            self._stopping.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+        await self.flush()
+
+    def add(self, document: dict) -> None:
+        # Never waits on Mongo; a full buffer is flushed in the background
+        self._buffer.append(document)
+        if len(self._buffer) >= self.max_batch:
+            task = asyncio.create_task(self.flush())
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    def update(self, filter: dict, update: dict) -> None:
+        self._updates.append(UpdateOne(filter, update))
+
+    async def flush(self) -> None:
+        async with self._lock:
+            # Take both at once: an update queued during the insert may target
+            # a document that is not part of this batch
+            batch, self._buffer = self._buffer, []
+            updates, self._updates = self._updates, []
+            await self._flush_inserts(batch)
+            await self._flush_updates(updates)
+
+    async def _flush_updates(self, updates: List[UpdateOne]) -> None:
+        if not updates:
+            return
+        try:
+            await self.collection.bulk_write(updates, ordered=True)
+        except Exception as e:
+            logger.error(f"Error applying {len(updates)} updates in MongoDB: {e}")
+
+    async def _flush_inserts(self, batch: List[dict]) -> None:
+        if not batch:
+            return
+        try:
+            await self.collection.insert_many(batch, ordered=False)
+            self.written += len(batch)
+        except BulkWriteError as e:
+            # Unordered inserts keep going past individual failures
+            inserted = e.details.get("nInserted", 0)
+            self.written += inserted
+            self.failed += len(batch) - inserted
+            logger.error(f"Error saving documents to MongoDB: {e.details.get('writeErrors')}")
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Error saving {len(batch)} documents to MongoDB: {e}")
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                await self.flush()
+
+
+async def ensure_indexes(
+    collected_collection,
+    user_collection,
+    notification_collection,
+    outbox_collection,
+    digest_collection,
+    notification_ttl_days: int = 30,
+) -> List[str]:
+    """Create the indexes the bot relies on and return the ones that were new.
+
+    Safe to run on every startup: existing indexes are left untouched.
+    """
+    specs = [
+        (user_collection, [("user_id", ASCENDING)], {"unique": True}),
+        (user_collection, [("status", ASCENDING), ("services", ASCENDING)], {}),
+        (
+            user_collection,
+            [("status", ASCENDING), ("trial_end_date", ASCENDING)],
+            {},
+        ),
+        (
+            notification_collection,
+            [
+                ("user_id", ASCENDING),
+                ("chat_id", ASCENDING),
+                ("message_id", ASCENDING),
+            ],
+            {"unique": True},
+        ),
+        (
+            notification_collection,
+            [("created_at", ASCENDING)],
+            {"expireAfterSeconds": notification_ttl_days * 24 * 60 * 60},
+        ),
+        (
+            collected_collection,
+            [("chat_id", ASCENDING), ("message_id", ASCENDING)],
+            {},
+        ),
+        (outbox_collection, [("state", ASCENDING), ("lease_until", ASCENDING)], {}),
+        (
+            digest_collection,
+            [
+                ("user_id", ASCENDING),
+                ("chat_id", ASCENDING),
+                ("message_id", ASCENDING),
+            ],
+            {"unique": True},
+        ),
+    ]
+
+    created = []
+    for collection, keys, options in specs:
+        existing = await collection.index_information()
+        try:
+            name = await collection.create_index(keys, **options)
+        except OperationFailure as e:
+            logger.error(f"Could not create index {keys} on {collection.name}: {e}")
+            # Uniqueness is what the upserts and dedup checks rely on
+            if options.get("unique"):
+                raise
+            continue
+        if name not in existing:
+            created.append(f"{collection.name}.{name}")
+    return created
+
+
+async def merge_duplicate_users(user_collection) -> int:
+    # One-off: racing /start handlers used to create several documents per
+    # user, which blocks the unique user_id index. Only needed until it exists.
+    for index in (await user_collection.index_information()).values():
+        if list(index["key"]) == [("user_id", ASCENDING)] and index.get("unique"):
+            return 0
+
+    seen, duplicated = set(), set()
+    async for user in user_collection.find({}, {"user_id": 1}):
+        user_id = user.get("user_id")
+        if user_id in seen:
+            duplicated.add(user_id)
+        seen.add(user_id)
+
+    removed = 0
+    for user_id in duplicated:
+        # Keep the oldest document, with everything the copies added to it
+        cursor = user_collection.find({"user_id": user_id}).sort("_id", ASCENDING)
+        users = await cursor.to_list(None)
+        kept, copies = users[0], users[1:]
+        services = list(kept.get("services", []))
+        for copy in copies:
+            services += [
+                service for service in copy.get("services", []) if service not in services
+            ]
+        trial_end_dates = [
+            user["trial_end_date"]
+            for user in users
+            if isinstance(user.get("trial_end_date"), datetime)
+        ]
+        update = {
+            "services": services,
+            "status": any(user.get("status") for user in users),
+        }
+        if trial_end_dates:
+            update["trial_end_date"] = max(trial_end_dates)
+        await user_collection.update_one({"_id": kept["_id"]}, {"$set": update})
+        for copy in copies:
+            await user_collection.delete_one({"_id": copy["_id"]})
+        removed += len(copies)
+    return removed
+
+
+async def migrate_trial_dates(user_collection, migration_collection) -> int:
+    # One-off conversion of legacy string trial_end_date values to datetimes.
+    # The $type query can't use an index, so it only runs until recorded.
+    name = "trial_dates"
+    if await migration_collection.find_one({"_id": name}) is not None:
+        return 0
+
+    updates = []
+    async for user in user_collection.find(
+        {"trial_end_date": {"$type": "string"}}, {"trial_end_date": 1}
+    ):
+        value = user["trial_end_date"]
+        try:
+            trial_end_date = datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            try:
+                trial_end_date = datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                logger.error(f"Unparseable trial_end_date {value!r} for {user['_id']}")
+                continue
+        updates.append(
+            UpdateOne({"_id": user["_id"]}, {"$set": {"trial_end_date": trial_end_date}})
+        )
+
+    if updates:
+        await user_collection.bulk_write(updates, ordered=False)
+    await migration_collection.update_one(
+        {"_id": name}, {"$set": {"applied_at": datetime.utcnow()}}, upsert=True
+    )
+    return len(updates)
+
+
+async def migrate_message_identity(
+    collected_collection, notification_collection, outbox_collection, migration_collection
+) -> int:
+    # One-off: messages are identified by (chat_id, message_id). Older documents
+    # never recorded the chat, so they get chat_id None and keep deduplicating
+    # among themselves. Recorded in `migration_collection` once done, since the
+    # chat_id query can't use an index and would scan everything on each start.
+    name = "message_identity"
+    if await migration_collection.find_one({"_id": name}) is not None:
+        return 0
+
+    legacy_index = "user_id_1_message_id_1"
+    if legacy_index in await notification_collection.index_information():
+        await notification_collection.drop_index(legacy_index)
+        logger.info(f"Dropped index {notification_collection.name}.{legacy_index}")
+
+    migrated = 0
+    for collection in (collected_collection, notification_collection, outbox_collection):
+        result = await collection.update_many(
+            {"chat_id": {"$exists": False}}, {"$set": {"chat_id": None}}
+        )
+        migrated += result.modified_count
+    await migration_collection.update_one(
+        {"_id": name}, {"$set": {"applied_at": datetime.utcnow()}}, upsert=True
+    )
+    return migrated
@@ -0,0 +1,76 @@
+from collections import defaultdict
+from typing import Dict, Iterable, Set
+
+
+class SubscriberIndex:
+    """In-memory index of which users subscribed to which service.
+
+    Kept in sync incrementally by the handlers so fan-out only has to look at
+    the users that actually picked one of the matched services. It also serves
+    each active user's own selection, and the set of services that at least one
+    active user watches (reference-counted by the number of subscribers).
+    """
+
+    def __init__(self) -> None:
+        self._by_service: Dict[str, Set[int]] = defaultdict(set)
+        self._by_user: Dict[int, Set[str]] = {}
+
+    async def load(self, user_collection) -> int:
+        # Rebuild the index from the users collection (active users only)
+        self._by_service.clear()
+        self._by_user.clear()
+        count = 0
+        async for user in user_collection.find(
+            {"status": True}, {"user_id": 1, "services": 1}
+        ):
+            self.set_services(user["user_id"], user.get("services", []))
+            count += 1
+        return count
+
+    def add(self, user_id: int, service: str) -> None:
+        self._by_service[service].add(user_id)
+        self._by_user.setdefault(user_id, set()).add(service)
+
+    def remove(self, user_id: int, service: str) -> None:
+        subscribers = self._by_service.get(service)
+        if subscribers is not None:
+            subscribers.discard(user_id)
+            if not subscribers:
+                del self._by_service[service]
+        services = self._by_user.get(user_id)
+        if services is not None:
+            services.discard(service)
+
+    def set_services(self, user_id: int, services: Iterable[str]) -> None:
+        self.drop_user(user_id)
+        self._by_user[user_id] = set()
+        for service in services:
+            self.add(user_id, service)
+
+    def drop_user(self, user_id: int) -> None:
+        for service in self._by_user.pop(user_id, ()):
+            subscribers = self._by_service.get(service)
+            if subscribers is not None:
+                subscribers.discard(user_id)
+                if not subscribers:
+                    del self._by_service[service]
+
+    def has_user(self, user_id: int) -> bool:
+        return user_id in self._by_user
+
+    def services_of(self, user_id: int) -> Set[str]:
+        return set(self._by_user.get(user_id, ()))
+
+    def is_watched(self, service: str) -> bool:
+        # Services are dropped from the index when their last subscriber leaves
+        return service in self._by_service
+
+    def watched_services(self) -> Set[str]:
+        return set(self._by_service)
+
+    def recipients(self, services: Iterable[str]) -> Set[int]:
+        # Union of subscribers for the given services
+        recipients: Set[int] = set()
+        for service in services:
+            recipients |= self._by_service.get(service, set())
+        return recipients